@@ -20,6 +20,7 @@
 
 import argparse
 import cpuinfo
+import hashlib
 import importlib
 import json
 import multiprocessing
@@ -61,11 +62,12 @@ from client import try_forever
 
 ## Basic configuration of the Client. These timeouts can be changed at will
 
-CLIENT_VERSION   = 49 # Client version to send to the Server
+CLIENT_VERSION   = 50 # Client version to send to the Server
 TIMEOUT_HTTP     = 30 # Timeout in seconds for HTTP requests
 TIMEOUT_ERROR    = 60 # Timeout in seconds when any errors are thrown
 TIMEOUT_WORKLOAD = 60 # Timeout in seconds between workload requests
 REPORT_INTERVAL  = 30 # Seconds between reports to the Server
+RESULT_RETRIES   = 10 # Attempts to resend results the Server failed to apply
 
 IS_WINDOWS = platform.system() == 'Windows' # Don't touch this
 IS_LINUX   = platform.system() != 'Windows' # Don't touch this
@@ -97,11 +99,18 @@ class Configuration:
         self.secret_token   = 'None'
         self.syzygy_max     = 2
         self.blacklist      = []
-
-        self.process_args(args)   # Rest of the command line settings
-        self.check_requirements() # Checks for Make, and g++ or clang++
-        self.init_client()        # Create folder structure and verify Syzygy
-        self.validate_setup()     # Check the threads and sockets values provided
+        self.next_workload  = None # Tentative next workload, as suggested by the Server
+        self.smt_nps        = None # Bench speeds on physical, and then logical, core counts
+        self.prefetch       = None # Thread preparing the tentative next workload
+        self.bundle         = []   # Workloads to play after this one, using the same binaries
+        self.numa_nodes     = []   # CPUs on each NUMA node, when exposed by the OS
+        self.journal        = None # Results yet to be acknowledged by the Server, kept on disk
+
+        self.process_args(args)    # Rest of the command line settings
+        self.check_requirements()  # Checks for Make, and g++ or clang++
+        self.init_client()         # Create folder structure and verify Syzygy
+        self.validate_setup()      # Check the threads and sockets values provided
+        self.scan_for_numa_nodes() # Topology, to pin each match runner copy to a Socket
 
     def process_args(self, args):
 
@@ -143,6 +152,12 @@ class Configuration:
             if not os.path.isdir(folder):
                 os.mkdir(folder)
 
+        # Results which were never acknowledged, before a crash or restart, are sent again.
+        # Each Server has its own journal, as Result ids mean nothing to any other Server
+        server_key   = hashlib.sha256(self.server.rstrip('/').encode()).hexdigest()[:8]
+        self.journal = ResultsJournal('openbench.%s.journal' % (server_key))
+        print('Looking for Unsent Results... [%d]' % (len(self.journal.entries)))
+
         # Check until we stop finding valid N-man tables
         if self.syzygy_path:
             while validate_syzygy_exists(self, self.syzygy_max+1):
@@ -161,6 +176,30 @@ class Configuration:
         assert self.threads % self.sockets == 0
         assert min(self.threads, self.sockets) >= 1
 
+    def scan_for_numa_nodes(self):
+
+        # Linux lists the CPUs of each node, like "0-15,64-79", under /sys
+        root = '/sys/devices/system/node'
+        if not os.path.isdir(root):
+            return
+
+        nodes = [x for x in os.listdir(root) if re.match(r'^node\d+$', x)]
+        for node in sorted(nodes, key=lambda x: int(x[4:])):
+
+            with open(os.path.join(root, node, 'cpulist')) as fin:
+                cpulist = fin.read().strip()
+
+            cpus = []
+            for span in filter(None, cpulist.split(',')):
+                first, _, last = span.partition('-')
+                cpus.extend(range(int(first), int(last or first) + 1))
+
+            # Memory-only nodes have no CPUs
+            if cpus:
+                self.numa_nodes.append(cpus)
+
+        print('\nLooking for NUMA Nodes... [%d]' % (len(self.numa_nodes)))
+
     def scan_for_compilers(self, data):
 
         print ('\nScanning for Compilers...')
@@ -276,6 +315,10 @@ class ServerReporter:
             'base_nps' : int(base_nps),
         }
 
+        # Include the SMT measurements, which are made once per session
+        if config.smt_nps:
+            payload['physical_nps'], payload['logical_nps'] = config.smt_nps
+
         return ServerReporter.report(config, 'clientSubmitNPS', payload)
 
     @staticmethod
@@ -315,7 +358,19 @@ class ServerReporter:
         return ServerReporter.report(config, 'clientBenchError', payload)
 
     @staticmethod
-    def report_results(config, batches):
+    def report_results(config, entry):
+
+        # Entries, from the ResultsJournal, are resent without modification
+        payload = dict(entry)
+
+        # Ask for a tentative next workload, until one is being prepared
+        if not config.prefetch:
+            payload['prefetch'] = True
+
+        return ServerReporter.report(config, 'clientSubmitResults', payload)
+
+    @staticmethod
+    def results_payload(config, batches):
 
         payload = {
 
@@ -360,7 +415,7 @@ class ServerReporter:
 
             payload['spsa_delta'] = json.dumps(ordered_delta)
 
-        return ServerReporter.report(config, 'clientSubmitResults', payload)
+        return payload
 
     @staticmethod
     def report_heartbeat(config):
@@ -369,8 +424,26 @@ class ServerReporter:
             'test_id' : config.workload['test']['id']
         }
 
+        # Ask for a tentative next workload, until one is being prepared
+        if not config.prefetch:
+            payload['prefetch'] = True
+
         return ServerReporter.report(config, 'clientHeartbeat', payload)
 
+    @staticmethod
+    def report_batch(config, entries):
+
+        # Each entry is a results payload, or a heartbeat, tagged by 'type'
+        payload = {
+            'entries' : json.dumps(entries)
+        }
+
+        # Ask for a tentative next workload, until one is being prepared
+        if not config.prefetch:
+            payload['prefetch'] = True
+
+        return ServerReporter.report(config, 'clientSubmitBatch', payload)
+
     @staticmethod
     def report_pgn(config, compressed_pgn_text):
 
@@ -619,6 +692,50 @@ class PGNHelper:
     def pretty_format(headers, moves):
         return '\n'.join(headers + [''] + moves)
 
+class ResultsJournal:
+
+    ## Results payloads are written to disk before being sent to the Server, and are
+    ## only removed once acknowledged. Anything left behind by a crash, or a restart,
+    ## is sent again later. Every payload is numbered, so that the Server is able to
+    ## discard any that it already applied, when a response was lost along the way
+
+    def __init__(self, fname):
+
+        self.fname    = fname
+        self.sequence = int(1000 * time.time()) # Never below the numbering of earlier runs
+        self.entries  = []
+
+        if os.path.isfile(fname):
+            with open(fname) as fin:
+                data = json.load(fin)
+            self.sequence = max(self.sequence, data['sequence'])
+            self.entries  = data['entries']
+
+    def append(self, payload):
+
+        self.sequence += 1
+        self.entries.append(dict(payload, type='results', sequence=self.sequence))
+        self.save()
+
+    def acknowledge(self, count, retry=()):
+
+        # The first count entries were sent, and were applied, or failed for good, except
+        # for those indexed by retry. Those are kept, for up to RESULT_RETRIES more attempts
+        retried = [dict(self.entries[x], retries=self.entries[x].get('retries', 0) + 1) for x in retry]
+        kept    = [x for x in retried if x['retries'] <= RESULT_RETRIES]
+
+        self.entries = kept + self.entries[count:]
+        self.save()
+
+        return len(retried) - len(kept) # Discarded, after too many attempts
+
+    def save(self):
+
+        # Write then rename, so that a crash never leaves behind a partial file
+        with open(self.fname + '.tmp', 'w') as fout:
+            json.dump({ 'sequence' : self.sequence, 'entries' : self.entries }, fout)
+        os.replace(self.fname + '.tmp', self.fname)
+
 class ResultsReporter(object):
 
     ## Handles idle looping while reading from the results Queue that the match runner
@@ -668,7 +785,8 @@ class ResultsReporter(object):
             else:
                 break
 
-        # Send any remaining results immediately
+        # Send any remaining results immediately. If that fails, they remain in the
+        # ResultsJournal, to be sent alongside the reports of the next workload
         self.send_results(report_interval=0, final_report=True)
 
     def send_results(self, report_interval, final_report=False):
@@ -677,17 +795,34 @@ class ResultsReporter(object):
         if self.last_report + report_interval > time.time():
             return False
 
+        # Heartbeat when no results, or still awaiting bulk results
+        heartbeat = not self.pending or (self.bulk and not final_report)
+
+        # Results are journaled before being sent, so nothing is lost if the send fails
+        if not heartbeat:
+            self.config.journal.append(ServerReporter.results_payload(self.config, self.pending))
+            self.pending = []
+
         try:
 
-            # Heartbeat when no results, or still awaiting bulk results
-            if not self.pending or (self.bulk and not final_report):
+            # Results left over from earlier attempts go out in the same request
+            if len(self.config.journal.entries) > (0 if heartbeat else 1):
+                response = self.send_batch(heartbeat)
+                self.last_report = time.time()
+
+            elif heartbeat:
                 response = ServerReporter.report_heartbeat(self.config).json()
                 self.last_report = time.time()
 
             else: # Send all of the queued Results at once
-                response = ServerReporter.report_results(self.config, self.pending).json()
+                response = ServerReporter.report_results(self.config, self.config.journal.entries[0]).json()
+                self.config.journal.acknowledge(1)
                 self.last_report = time.time()
-                self.pending = []
+
+            # Start preparing the next workload, if the Server suggested one
+            if 'prefetch' in response:
+                self.config.next_workload = response['prefetch']
+                start_prefetch(self.config)
 
             # If the test ended, kill all tasks
             if 'stop' in response:
@@ -704,6 +839,36 @@ class ResultsReporter(object):
             print ('[Note] Failed to upload results to server...')
             self.last_report = time.time()
 
+    def send_batch(self, heartbeat):
+
+        # Our own results are already the last entry in the ResultsJournal
+        entries = list(self.config.journal.entries)
+        if heartbeat:
+            entries.append({ 'type' : 'heartbeat', 'test_id' : self.config.workload['test']['id'] })
+
+        # Entries are acknowledged together, with our own response last. Any which the
+        # Server failed to apply, but might apply later, stay in the ResultsJournal
+        response  = ServerReporter.report_batch(self.config, entries).json()
+        journaled = len(self.config.journal.entries)
+        responses = response['entries'][:journaled]
+
+        retry    = [x for x, entry in enumerate(responses) if 'error' in entry and entry.get('retry')]
+        rejected = [x for x, entry in enumerate(responses) if 'error' in entry and not entry.get('retry')]
+        rejected = len(rejected) + self.config.journal.acknowledge(journaled, retry)
+
+        if rejected:
+            print ('[Note] Server rejected %d results, which were discarded...' % (rejected))
+
+        if retry:
+            print ('[Note] Server failed to apply %d results, which may be resent...' % (len(retry)))
+
+        # Merge in the Prefetch, which is given once for the whole batch
+        result = response['entries'][-1]
+        if 'prefetch' in response:
+            result['prefetch'] = response['prefetch']
+
+        return result
+
     def send_errors(self, timestamp, runner_cnt):
 
         for x in range(runner_cnt):
@@ -1013,6 +1178,7 @@ def server_configure_worker(config):
         'machine_name'   : config.identity,       # Optional pseudonym for the machine, otherwise None
         'concurrency'    : config.threads,        # Threads to use to play games
         'sockets'        : config.sockets,        # Match runner copies, usually equal to Socket count
+        'numa_nodes'     : config.numa_nodes,     # CPUs on each NUMA node, to pin match runner copies
         'syzygy_max'     : config.syzygy_max,     # Whether or not the machine has Syzygy support
         'noisy'          : config.noisy,          # Whether our results are unstable for time-based workloads
         'focus'          : config.focus,          # List of engines we have a preference to help
@@ -1047,7 +1213,16 @@ def server_request_workload(config):
 
     print('\nRequesting Workload from Server...')
 
-    payload  = { 'machine_id' : config.machine_id, 'secret' : config.secret_token, 'blacklist' : config.blacklist }
+    # Report cached Engines and Networks, so that workloads needing no builds are favoured
+    binaries = [x[:-4] if x.endswith('.exe') else x for x in os.listdir('Engines')]
+    networks = os.listdir('Networks')
+
+    payload  = {
+        'machine_id' : config.machine_id, 'secret'   : config.secret_token, 'blacklist' : config.blacklist,
+        'binaries'   : binaries,          'networks' : networks,            'prefetch'  : True,
+        'bundle'     : True,
+    }
+
     target   = utils.url_join(config.server, 'clientGetWorkload')
     response = requests.post(target, data=payload, timeout=TIMEOUT_HTTP)
 
@@ -1072,11 +1247,18 @@ def server_request_workload(config):
         base_name   = response['workload']['test']['base']['name'  ]
         print('Workload [%s] %s vs [%s] %s\n' % (dev_engine, dev_name, base_engine, base_name))
 
-    config.workload = response.get('workload', None)
+    config.workload      = response.get('workload', None)
+    config.bundle        = response.get('bundle', [])
+    config.next_workload = response.get('prefetch', None)
 
 
 def complete_workload(config):
 
+    # Finish any preparation of this workload, started during the last one
+    if config.prefetch:
+        config.prefetch.join()
+        config.prefetch = None
+
     # Download the opening book, throws an exception on corruption
     utils.download_opening_book(
         config.workload['test']['book']['sha'   ],
@@ -1092,13 +1274,38 @@ def complete_workload(config):
     dev_name  = safe_download_engine(config, 'dev' , dev_network )
     base_name = safe_download_engine(config, 'base', base_network)
 
-    # Datagen creates a book on-the-fly
-    if config.workload['test']['type'] == 'DATAGEN':
-        safe_create_genfens_opening_book(config, dev_name)
+    # Measure the value of SMT once, if playing with more threads than physical cores
+    if config.smt_nps is None and config.threads > config.physical_cores:
+        config.smt_nps = measure_smt_throughput(config, dev_name)
 
     # Scale time control based on the Engine's local NPS
     scale_factor = determine_scale_factor(config, dev_name, base_name)
 
+    play_workload(config, dev_name, base_name, scale_factor)
+
+    # Bundled workloads share the binaries, and so the benchmarks, of the first
+    for workload in config.bundle:
+
+        if os.path.isfile('openbench.exit'):
+            break
+
+        config.workload = workload
+        print('\nBundled Workload #%d' % (workload['test']['id']))
+
+        utils.download_opening_book(
+            config.workload['test']['book']['sha'   ],
+            config.workload['test']['book']['source'],
+            config.workload['test']['book']['name'  ],
+        )
+
+        play_workload(config, dev_name, base_name, scale_factor)
+
+def play_workload(config, dev_name, base_name, scale_factor):
+
+    # Datagen creates a book on-the-fly
+    if config.workload['test']['type'] == 'DATAGEN':
+        safe_create_genfens_opening_book(config, dev_name)
+
     # Server knows how many copies of the match runner we should run
     runner_cnt      = config.workload['distribution']['runner-count']
     concurrency_per = config.workload['distribution']['concurrency-per']
@@ -1121,6 +1328,9 @@ def complete_workload(config):
             cmd = build_runner_command(config, dev_name, base_name, scale_factor, timestamp, x)
             tasks.append(executor.submit(run_and_parse_runner, config, cmd, x, results, abort_flag))
 
+        # Prepare the next workload in the background, if one was suggested
+        start_prefetch(config)
+
         # Process the Queue until we exit, finish, or are told to stop by the server
         try:
             rr = ResultsReporter(config, tasks, results, abort_flag)
@@ -1140,6 +1350,55 @@ def complete_workload(config):
             pgn_files  = [MatchRunner.pgn_name(config, timestamp, x) for x in range(runner_cnt)]
             ServerReporter.report_pgn(config, pgn_util.compress_pgn_files(pgn_files, scale_factor, compact))
 
+def start_prefetch(config):
+
+    # Only prepare one tentative workload, per workload, and never a blacklisted one
+    if config.prefetch or not config.next_workload:
+        return
+
+    if config.next_workload['id'] in config.blacklist:
+        return
+
+    # Building competes for the CPU, so avoid doing so while playing with time
+    dev_tc  = config.workload['test']['dev' ]['time_control']
+    base_tc = config.workload['test']['base']['time_control']
+    build   = all(x.startswith('N=') or x.startswith('D=') for x in (dev_tc, base_tc))
+
+    config.prefetch = threading.Thread(target=prefetch_workload, args=(config, config.next_workload, build), daemon=True)
+    config.prefetch.start()
+
+def prefetch_workload(config, prefetch, build):
+
+    # Failures are ignored, and will resurface if the workload is actually assigned
+
+    try:
+
+        utils.download_opening_book(
+            prefetch['book']['sha'   ],
+            prefetch['book']['source'],
+            prefetch['book']['name'  ],
+        )
+
+        for branch in ['dev', 'base']:
+
+            engine   = prefetch[branch]
+            net_path = None
+
+            if engine['network'] and engine['network'] != 'None':
+                net_path    = os.path.join('Networks', engine['network'])
+                credentials = (config.server, config.username, config.password)
+                utils.download_network(*credentials, engine['engine'], engine['netname'], engine['network'], net_path)
+
+            if build and engine['engine'] in config.compilers:
+                bin_name = utils.engine_binary_name(engine['engine'], engine['sha'], net_path)
+                out_path = os.path.join('Engines', bin_name)
+                compiler = config.compilers[engine['engine']][0]
+                utils.prepare_engine(engine['engine'], net_path, engine['name'], engine['source'],
+                    engine['build']['path'], out_path, engine['private'], compiler)
+
+    except Exception:
+        print ('[Note] Unable to prepare the next workload ahead of time...')
+
 def safe_download_network_weights(config, branch):
 
     # Wraps utils.py:download_network()
@@ -1214,10 +1473,11 @@ def safe_run_benchmarks(config, branch, engine):
     name     = config.workload['test'][branch]['name']
     expected = int(config.workload['test'][branch]['bench'])
     binary   = os.path.join('Engines', engine)
+    threads  = config.workload['distribution'].get('bench-threads', config.threads)
 
     try:
-        print('\nRunning %dx Benchmarks for %s' % (config.threads, name))
-        speed, nodes = bench.run_benchmark(binary, config.threads, 1, expected)
+        print('\nRunning %dx Benchmarks for %s' % (threads, name))
+        speed, nodes = bench.run_benchmark(binary, threads, 1, expected)
 
     except utils.OpenBenchBadBenchException as error:
         ServerReporter.report_bad_bench(config, error.message)
@@ -1228,6 +1488,25 @@ def safe_run_benchmarks(config, branch, engine):
     return speed
 
 
+def measure_smt_throughput(config, dev_name):
+
+    # Speed of each bench, when running one per physical core, and then one per thread.
+    # Any errors will resurface, and be reported, when determining the scale factor
+
+    binary   = os.path.join('Engines', dev_name)
+    expected = int(config.workload['test']['dev']['bench'])
+
+    try:
+        print('\nMeasuring SMT with %dx and %dx Benchmarks' % (config.physical_cores, config.threads))
+        physical = bench.run_benchmark(binary, config.physical_cores, 1, expected)[0]
+        logical  = bench.run_benchmark(binary, config.threads, 1, expected)[0]
+
+    except utils.OpenBenchBadBenchException:
+        return (0, 0)
+
+    print('Speed per bench is %d and %d' % (physical, logical))
+    return (physical, logical)
+
 def build_runner_command(config, dev_cmd, base_cmd, scale_factor, timestamp, runner_idx):
 
     flags  = ' ' + MatchRunner.basic_settings(config)
@@ -1243,7 +1522,22 @@ def build_runner_command(config, dev_cmd, base_cmd, scale_factor, timestamp, run
 def run_and_parse_runner(config, command, runner_idx, results_queue, abort_flag):
 
     print('\n[#%d] Launching match runner...\n%s\n' % (runner_idx, command))
-    runner = Popen(shlex.split(command), stdout=PIPE)
+
+    # Pin the match runner, and so the engines it launches, to its own CPUs if provided
+    cpusets = config.workload['distribution'].get('cpusets')
+    cpus    = cpusets[runner_idx] if cpusets else None
+
+    # Launch under taskset where possible, so no engine can start elsewhere. preexec_fn
+    # would do the same, but is unsafe here, since runners are launched from threads
+    if cpus and shutil.which('taskset'):
+        taskset = ['taskset', '-c', ','.join(map(str, cpus))]
+        runner  = Popen(taskset + shlex.split(command), stdout=PIPE)
+
+    else:
+        runner = Popen(shlex.split(command), stdout=PIPE)
+        if cpus:
+            try: psutil.Process(runner.pid).cpu_affinity(cpus)
+            except (psutil.Error, AttributeError): print ('[Note] Unable to set CPU affinity...')
 
     results = {
 
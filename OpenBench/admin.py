@@ -27,3 +27,7 @@ django.contrib.admin.site.register(OpenBench.models.Result)
 django.contrib.admin.site.register(OpenBench.models.Test)
 django.contrib.admin.site.register(OpenBench.models.LogEvent)
 django.contrib.admin.site.register(OpenBench.models.Network)
+django.contrib.admin.site.register(OpenBench.models.BookCursor)
+django.contrib.admin.site.register(OpenBench.models.ActiveAssignment)
+django.contrib.admin.site.register(OpenBench.models.ResultJournal)
+django.contrib.admin.site.register(OpenBench.models.ProgressPoint)
@@ -84,6 +84,13 @@ class OpenBenchConfig(django.apps.AppConfig):
             self.pgn_watcher = PGNWatcher(self.stop_pgn_watcher, daemon=True)
             self.pgn_watcher.start()
 
+            # Start a Result Flusher, if results are being aggregated
+            if config.OPENBENCH_CONFIG['aggregate_results']:
+                from OpenBench.result_flusher import ResultFlusher
+                self.stop_result_flusher = threading.Event()
+                self.result_flusher = ResultFlusher(self.stop_result_flusher, daemon=True)
+                self.result_flusher.start()
+
             # We expect a nice sys.exit(0) to allow our atexit to execute
             atexit.register(self.shutdown)
 
@@ -94,6 +101,11 @@ class OpenBenchConfig(django.apps.AppConfig):
             self.stop_pgn_watcher.set()
             self.pgn_watcher.join()
 
+        # Signal the Result Flusher to shutdown. Pending results remain in the journal
+        if hasattr(self, 'result_flusher') and self.result_flusher.is_alive():
+            self.stop_result_flusher.set()
+            self.result_flusher.join()
+
         # Cleanup Lockfile if we hold it
         if self.lockfile:
             self.lockfile.close()
@@ -112,6 +112,11 @@ def verify_general_config(conf):
     assert type(conf.get('require_login_to_view'      ) == bool)
     assert type(conf.get('require_manual_registration') == bool)
     assert type(conf.get('balance_engine_throughputs' ) == bool)
+    assert type(conf.get('weight_machines_by_nps'     ) == bool)
+    assert type(conf.get('hash_memory_fraction'       ) == float)
+    assert type(conf.get('workload_target_seconds'    ) == int)
+    assert type(conf.get('workload_bundle_size'       ) == int)
+    assert type(conf.get('aggregate_results'          ) == bool)
 
 def verify_engine_basics(conf):
 
@@ -0,0 +1,125 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#                                                                             #
+#   OpenBench is a chess engine testing framework authored by Andrew Grant.   #
+#   <https://github.com/AndyGrant/OpenBench>           <andrew@grantnet.us>   #
+#                                                                             #
+#   OpenBench is free software: you can redistribute it and/or modify         #
+#   it under the terms of the GNU General Public License as published by      #
+#   the Free Software Foundation, either version 3 of the License, or         #
+#   (at your option) any later version.                                       #
+#                                                                             #
+#   OpenBench is distributed in the hope that it will be useful,              #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#   GNU General Public License for more details.                              #
+#                                                                             #
+#   You should have received a copy of the GNU General Public License         #
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+# Offline benchmark of the index page. A throwaway SQLite database is filled with a
+# page of completed Tests and a number of active Tests, each with results, and then
+# the index is rendered repeatedly, once using scipy.stats.t.ppf() directly for the
+# Elo confidence intervals, and once using the cached OpenBench.stats.student_t_ppf()
+#
+# >>> python manage.py bench_index --active 50 --renders 100
+
+import os
+import random
+import scipy.stats
+import statistics
+import time
+
+from django.db import connection
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+import OpenBench.stats
+
+from OpenBench.config import OPENBENCH_CONFIG
+from OpenBench.management.commands.simulate_scheduler import use_throwaway_database, create_synthetic_tests
+
+def add_synthetic_results(tests, completed):
+
+    # Every Test is given pentanomial results, so that Elo() is exercised when rendered
+
+    for x, test in enumerate(tests):
+
+        pairs = random.randint(1000, 40000)
+        test.LL, test.LD, test.DD, test.DW, test.WW = [
+            int(pairs * p) for p in (0.01, 0.20, 0.57, 0.21, 0.01)
+        ]
+
+        test.losses = 2 * test.LL + test.LD
+        test.draws  = 2 * test.DD + test.LD + test.DW
+        test.wins   = 2 * test.WW + test.DW
+        test.games  = 2 * pairs
+
+        test.use_penta = True
+        test.finished  = x < completed
+        test.passed    = test.finished and random.random() < 0.5
+        test.failed    = test.finished and not test.passed
+        test.save()
+
+class Command(BaseCommand):
+
+    help = 'Times rendering of the index page, with and without cached Student-t quantiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--active' , type=int, default=50 , help='Active Tests to create, beyond a page of completed Tests')
+        parser.add_argument('--renders', type=int, default=100, help='Renders to time, for each quantile method')
+        parser.add_argument('--seed'   , type=int, default=0  , help='Seed for generating the synthetic data')
+
+    def handle(self, *args, **options):
+
+        random.seed(options['seed'])
+        path = use_throwaway_database()
+
+        try:
+            self.benchmark(options)
+
+        finally:
+            connection.close()
+            os.remove(path)
+
+    def benchmark(self, options):
+
+        completed   = 25 # One full page of the index
+        engines     = sorted(OPENBENCH_CONFIG['engines'].keys())[:8]
+        user, tests = create_synthetic_tests(completed + options['active'], engines)
+        add_synthetic_results(tests, completed)
+
+        client = Client()
+        client.force_login(user)
+
+        methods = [
+            ('scipy.stats.t.ppf', lambda q, df: float(scipy.stats.t.ppf(q, df))),
+            ('student_t_ppf'    , OpenBench.stats.student_t_ppf),
+        ]
+
+        self.stdout.write('Rendering the index %d times, with %d completed and %d active Tests' % (
+            options['renders'], completed, options['active']))
+
+        original, timings = OpenBench.stats.student_t_ppf, {}
+
+        try:
+            for name, method in methods:
+
+                OpenBench.stats.student_t_ppf = method
+                client.get('/') # Warm up the templates and any caches
+
+                latency = []
+                for x in range(options['renders']):
+                    start = time.perf_counter()
+                    assert client.get('/').status_code == 200
+                    latency.append(time.perf_counter() - start)
+
+                timings[name] = statistics.median(latency)
+                self.stdout.write('%-17s: %8.3f ms' % (name, 1000 * timings[name]))
+
+        finally:
+            OpenBench.stats.student_t_ppf = original
+
+        self.stdout.write('Speedup          : %8.2fx' % (timings['scipy.stats.t.ppf'] / timings['student_t_ppf']))
@@ -0,0 +1,132 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#                                                                             #
+#   OpenBench is a chess engine testing framework authored by Andrew Grant.   #
+#   <https://github.com/AndyGrant/OpenBench>           <andrew@grantnet.us>   #
+#                                                                             #
+#   OpenBench is free software: you can redistribute it and/or modify         #
+#   it under the terms of the GNU General Public License as published by      #
+#   the Free Software Foundation, either version 3 of the License, or         #
+#   (at your option) any later version.                                       #
+#                                                                             #
+#   OpenBench is distributed in the hope that it will be useful,              #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#   GNU General Public License for more details.                              #
+#                                                                             #
+#   You should have received a copy of the GNU General Public License         #
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# Recomputes the LLR of every SPRT Test, after a change to the SPRT bounds or to the
+# stats code, along with whether each Test passed or failed. Tests are loaded a chunk
+# at a time, solved together with PentanomialSPRTBatch(), and written back in bulk.
+#
+# An active Test which now crosses a bound is finished, as it would be by apply_result_deltas().
+# Finished Tests only have their LLR updated, since their outcome may have been decided by
+# hand, or by bounds since changed. With --outcomes, those are rewritten from the new LLR as
+# well. A finished Test is never resumed, even when its LLR no longer crosses either bound.
+#
+# >>> python manage.py recompute_llr --chunk 5000 --dry-run
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from OpenBench.models import Test
+from OpenBench.stats import TrinomialSPRT, PentanomialSPRTBatch
+
+LLR_TOLERANCE = 1e-6 # Smaller changes to the LLR are not written back
+
+SPRT_FIELDS = [
+    'id', 'use_tri', 'use_penta', 'elolower', 'eloupper', 'lowerllr', 'upperllr',
+    'losses', 'draws', 'wins', 'LL', 'LD', 'DD', 'DW', 'WW',
+]
+
+RECOMPUTED_FIELDS = ['currentllr', 'passed', 'failed', 'finished']
+
+def recompute_tests(tests, outcomes=False):
+
+    # Pentanomial Tests are solved together, and Trinomial Tests one at a time
+    penta = [test for test in tests if test.use_penta]
+    tri   = [test for test in tests if test.use_tri and not test.use_penta]
+
+    llrs = PentanomialSPRTBatch(
+        [test.as_penta() for test in penta],
+        [test.elolower   for test in penta],
+        [test.eloupper   for test in penta],
+    )
+
+    llrs = dict(zip(penta, map(float, llrs)))
+    for test in tri:
+        llrs[test] = TrinomialSPRT(test.as_tri(), test.elolower, test.eloupper)
+
+    # Tests with only a new LLR, and Tests with a new outcome as well
+    modified, decided = [], []
+
+    for test, llr in llrs.items():
+
+        before = (test.currentllr, test.passed, test.failed, test.finished)
+
+        test.currentllr = llr
+
+        # Check for H0 or H1 being accepted, unless the Test already has an outcome
+        if outcomes or not test.finished:
+            test.passed   = llr > test.upperllr
+            test.failed   = llr < test.lowerllr
+            test.finished = test.finished or test.passed or test.failed
+
+        if before[1:] != (test.passed, test.failed, test.finished):
+            decided.append(test)
+
+        elif abs(llr - before[0]) > LLR_TOLERANCE:
+            modified.append(test)
+
+    return modified, decided
+
+class Command(BaseCommand):
+
+    help = 'Recomputes the LLR of every SPRT Test in bulk, finishing any active Test that crosses a bound'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk'   , type=int, default=5000, help='Tests to load, solve, and save at once')
+        parser.add_argument('--active'  , action='store_true'   , help='Only recompute Tests yet to finish')
+        parser.add_argument('--dry-run' , action='store_true'   , help='Report what would change, without saving')
+        parser.add_argument('--outcomes', action='store_true'   , help='Also rewrite passed and failed for finished Tests')
+
+    def handle(self, *args, **options):
+
+        tests = Test.objects.filter(test_mode='SPRT')
+        if options['active']:
+            tests = tests.filter(finished=False, deleted=False)
+
+        ids   = list(tests.order_by('id').values_list('id', flat=True))
+        start = time.perf_counter()
+        total = outcomes = 0
+
+        for x in range(0, len(ids), options['chunk']):
+
+            # Locked, so that results being applied to active Tests are not overwritten
+            with transaction.atomic():
+
+                chunk = Test.objects.select_for_update().filter(id__in=ids[x:x+options['chunk']])
+                chunk = list(chunk.only(*SPRT_FIELDS, *RECOMPUTED_FIELDS))
+
+                modified, decided = recompute_tests(chunk, options['outcomes'])
+
+                # Most Tests only need their LLR written, which is far cheaper than every field
+                if not options['dry_run']:
+                    Test.objects.bulk_update(modified, ['currentllr'], batch_size=500)
+                    Test.objects.bulk_update(decided, RECOMPUTED_FIELDS, batch_size=500)
+
+            total    += len(modified) + len(decided)
+            outcomes += len(decided)
+
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write('Tests recomputed : %8d'     % (len(ids)))
+        self.stdout.write('Tests modified   : %8d%s'   % (total, ' (dry run)' if options['dry_run'] else ''))
+        self.stdout.write('Outcomes changed : %8d'     % (outcomes))
+        self.stdout.write('Elapsed          : %8.3f s' % (elapsed))
+        self.stdout.write('Throughput       : %8.0f tests/s' % (len(ids) / max(elapsed, 1e-9)))
@@ -0,0 +1,295 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#                                                                             #
+#   OpenBench is a chess engine testing framework authored by Andrew Grant.   #
+#   <https://github.com/AndyGrant/OpenBench>           <andrew@grantnet.us>   #
+#                                                                             #
+#   OpenBench is free software: you can redistribute it and/or modify         #
+#   it under the terms of the GNU General Public License as published by      #
+#   the Free Software Foundation, either version 3 of the License, or         #
+#   (at your option) any later version.                                       #
+#                                                                             #
+#   OpenBench is distributed in the hope that it will be useful,              #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#   GNU General Public License for more details.                              #
+#                                                                             #
+#   You should have received a copy of the GNU General Public License         #
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# Offline simulation of workload assignment. A throwaway SQLite database is filled
+# with synthetic Machines and Tests, and then clientGetWorkload requests are replayed
+# against get_workload(), to measure latency, query counts, and fairness.
+#
+# With --ingest, threads apply results to the same Tests throughout the replay, and
+# the time spent reserving opening book ranges is reported, which includes any wait
+# on locks held by result ingestion. SQLite locks the whole database for writes, so
+# here that wait is bounded by the length of each write, not removed. Only servers
+# with row-level locking see allocation escape the lock held on the Test.
+#
+# >>> python manage.py simulate_scheduler --machines 2000 --tests 40 --requests 10000 --ingest 4
+
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, OperationalError
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+import OpenBench.utils
+import OpenBench.views # Loads OpenBench.workloads in a safe order
+import OpenBench.workloads.get_workload
+
+from OpenBench.config import OPENBENCH_CONFIG
+from OpenBench.models import *
+from OpenBench.scheduler import SNAPSHOT
+from OpenBench.workloads.get_workload import get_workload
+
+def use_throwaway_database():
+
+    # Point the default connection at a new, empty, and fully migrated SQLite file
+
+    fd, path = tempfile.mkstemp(prefix='openbench.', suffix='.sqlite3')
+    os.close(fd)
+
+    connection.close()
+    settings.DATABASES['default']['ENGINE'] = 'django.db.backends.sqlite3'
+    settings.DATABASES['default']['NAME'  ] = path
+
+    call_command('migrate', verbosity=0)
+    SNAPSHOT.reset()
+
+    return path
+
+def create_synthetic_tests(count, engines):
+
+    user  = User.objects.create(username='simulator')
+    Profile.objects.create(user=user, enabled=True, approver=True)
+    tests = []
+
+    for x in range(count):
+
+        engine  = random.choice(engines)
+        threads = random.choice([1, 1, 1, 1, 2, 4, 8])
+        hashes  = 8 * threads * random.choice([1, 2, 4, 8])
+        control = random.choice(['10.0+0.10', '60.0+0.60', '40/20.0+0.00', 'N=25000'])
+
+        test = Test(
+            author            = user.username,
+            book_name         = 'UHO_Lichess_4852_v1.epd',
+            dev               = Engine.objects.create(name='dev%d'  % (x), source='', sha='%040x' % (2*x+0)),
+            base              = Engine.objects.create(name='base%d' % (x), source='', sha='%040x' % (2*x+1)),
+            dev_engine        = engine,
+            base_engine       = engine,
+            dev_options       = 'Threads=%d Hash=%d' % (threads, hashes),
+            base_options      = 'Threads=%d Hash=%d' % (threads, hashes),
+            dev_time_control  = control,
+            base_time_control = control,
+            priority          = random.choice([0, 0, 0, 0, 0, 0, 0, 1]),
+            throughput        = random.choice([100, 100, 100, 200, 250, 500, 1000]),
+            scale_nps         = OPENBENCH_CONFIG['engines'][engine]['nps'],
+            syzygy_wdl        = random.choice(['OPTIONAL', 'OPTIONAL', 'OPTIONAL', 'DISABLED', '5-MAN', '6-MAN']),
+            test_mode         = random.choice(['SPRT', 'SPRT', 'SPRT', 'GAMES']),
+            max_games         = 40000,
+            approved          = True,
+        )
+
+        OpenBench.utils.set_workload_requirements(test)
+        test.save()
+        BookCursor.objects.create(test=test)
+        tests.append(test)
+
+    return user, tests
+
+def create_synthetic_machines(count, user, engines):
+
+    machines = []
+
+    for x in range(count):
+
+        concurrency = random.choice([4, 8, 8, 16, 16, 32, 64, 128])
+        sockets     = random.choice([1, 1, 1, 2]) if concurrency >= 32 else 1
+        hyperthread = random.random() < 0.5
+
+        info = {
+            'concurrency'    : concurrency,
+            'physical_cores' : concurrency // 2 if hyperthread else concurrency,
+            'logical_cores'  : concurrency,
+            'sockets'        : sockets,
+            'ram_total_mb'   : random.choice([8, 16, 32, 64, 128, 256]) * 1024,
+            'syzygy_max'     : random.choice([0, 0, 5, 6, 7]),
+            'noisy'          : random.random() < 0.10,
+            'focus'          : [random.choice(engines)] if random.random() < 0.10 else [],
+            'supported'      : engines,
+        }
+
+        machines.append(Machine.objects.create(user=user, info=info, secret='simulator'))
+
+    return machines
+
+def fairness_error():
+
+    # Compare each Test's share of threads to the ideal share for its throughput,
+    # amongst Tests sharing its priority. Errors are averaged, weighted by threads
+
+    groups = {}
+    for test in SNAPSHOT.active_tests():
+        threads = SNAPSHOT.assigned.get(test['id'], { 'threads' : 0 })['threads']
+        groups.setdefault(test['priority'], []).append((threads, test['throughput']))
+
+    error = weight = 0.00
+
+    for group in groups.values():
+
+        thread_sum     = sum(threads for threads, throughput in group)
+        throughput_sum = sum(throughput for threads, throughput in group)
+
+        if not thread_sum:
+            continue
+
+        fair_ratio = thread_sum / throughput_sum
+        for threads, throughput in group:
+            error  += threads * abs(threads / throughput / fair_ratio - 1.00)
+            weight += threads
+
+    return error / max(1, weight)
+
+def percentile(values, percent):
+    return sorted(values)[min(len(values) - 1, int(len(values) * percent / 100))]
+
+def timed(function, timings):
+
+    # Wrap function, recording the duration of each call into timings
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try: return function(*args, **kwargs)
+        finally: timings.append(time.perf_counter() - start)
+
+    return wrapper
+
+def ingest_results(tests, machine, stop_event, applied, locked):
+
+    # Apply small pentanomial results to random Tests, as Clients would, until stopped.
+    # Expect SQLite to report the database as locked sometimes; count those, and retry
+
+    delta = {
+        'machine_id' : machine.id, 'user_id' : machine.user_id, 'sequence' : 0,
+        'losses' : 4, 'draws' : 2, 'wins' : 4, 'games' : 10, 'LL' : 1, 'LD' : 1, 'DD' : 1, 'DW' : 1, 'WW' : 1,
+        'crashes' : 0, 'timelosses' : 0, 'illegals' : 0, 'spsa_delta' : [],
+    }
+
+    try:
+        while not stop_event.is_set():
+            test, result = random.choice(tests)
+            try:
+                OpenBench.utils.apply_result_deltas(test.id, [dict(delta, test_id=test.id, result_id=result.id)])
+                applied.append(1)
+
+            except OperationalError as error:
+                if 'database is locked' not in str(error).lower():
+                    raise
+                locked.append(1)
+
+    finally:
+        connection.close()
+
+class Command(BaseCommand):
+
+    help = 'Replays workload requests from synthetic Machines against a throwaway database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--machines', type=int, default=1000, help='Synthetic Machines to create')
+        parser.add_argument('--tests'   , type=int, default=20  , help='Synthetic Tests to create')
+        parser.add_argument('--requests', type=int, default=0   , help='Requests to replay, defaulting to 3 per Machine')
+        parser.add_argument('--seed'    , type=int, default=0   , help='Seed for generating the synthetic data')
+        parser.add_argument('--ingest'  , type=int, default=0   , help='Threads applying results during the replay')
+
+    def handle(self, *args, **options):
+
+        random.seed(options['seed'])
+        path = use_throwaway_database()
+
+        try:
+            self.simulate(options)
+
+        finally:
+            connection.close()
+            os.remove(path)
+
+    def simulate(self, options):
+
+        engines        = sorted(OPENBENCH_CONFIG['engines'].keys())[:8]
+        user, tests    = create_synthetic_tests(options['tests'], engines)
+        machines       = create_synthetic_machines(options['machines'], user, engines)
+        requests       = options['requests'] or 3 * len(machines)
+        factory        = RequestFactory()
+        latency, query = [], []
+
+        self.stdout.write('Replaying %d requests from %d Machines, across %d Tests' % (requests, len(machines), len(tests)))
+
+        # Time every reservation of an opening book range
+        allocate   = OpenBench.workloads.get_workload.allocate_book_indices
+        allocation = []
+        OpenBench.workloads.get_workload.allocate_book_indices = timed(allocate, allocation)
+
+        # Results are applied from other threads, each with their own connection
+        stop_event, applied, locked = threading.Event(), [], []
+        targets = [(x, Result.objects.create(test=x, machine=machines[0], user=user)) for x in tests if options['ingest']]
+        workers = [
+            threading.Thread(target=ingest_results, args=(targets, machines[0], stop_event, applied, locked))
+            for x in range(options['ingest'])
+        ]
+
+        for worker in workers:
+            worker.start()
+
+        try:
+            self.replay(requests, machines, factory, latency, query)
+
+        finally:
+            stop_event.set()
+            for worker in workers:
+                worker.join()
+            OpenBench.workloads.get_workload.allocate_book_indices = allocate
+
+        idle = sum(1 for machine in machines if machine.id not in SNAPSHOT.machines)
+
+        self.stdout.write('Latency p50      : %8.3f ms' % (1000 * percentile(latency, 50)))
+        self.stdout.write('Latency p99      : %8.3f ms' % (1000 * percentile(latency, 99)))
+        self.stdout.write('Queries mean     : %8.3f'    % (statistics.mean(query)))
+        self.stdout.write('Queries max      : %8d'      % (max(query)))
+        self.stdout.write('Fairness error   : %8.3f%%'  % (100 * fairness_error()))
+        self.stdout.write('Never assigned   : %8d'      % (idle))
+
+        if allocation:
+            self.stdout.write('Book alloc p50   : %8.3f ms' % (1000 * percentile(allocation, 50)))
+            self.stdout.write('Book alloc p99   : %8.3f ms' % (1000 * percentile(allocation, 99)))
+
+        if workers:
+            self.stdout.write('Results applied  : %8d'      % (len(applied)))
+            self.stdout.write('Results locked   : %8d'      % (len(locked)))
+
+    def replay(self, requests, machines, factory, latency, query):
+
+        for x in range(requests):
+
+            # Every Machine requests once, before any Machine requests again
+            machine = machines[x % len(machines)]
+            request = factory.post('/clientGetWorkload/', { 'machine_id' : machine.id, 'secret' : machine.secret })
+
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                get_workload(request, machine)
+                latency.append(time.perf_counter() - start)
+
+            query.append(len(context.captured_queries))
@@ -0,0 +1,92 @@
+# Generated by Django 4.2.1 on 2026-10-17 07:15
+
+# Backfill the requirement columns for existing Tests, so that workload
+# assignment can filter on them directly instead of parsing option strings.
+
+import re
+
+from django.db import migrations, models
+
+def extract_option(options, option):
+
+    for pattern in (r'(?<={0}=")[^"]*', r"(?<={0}=')[^']*", r'(?<={0}=)[^ ]*'):
+        if (match := re.search(pattern.format(option), options)):
+            return match.group()
+
+def option_as_int(options, option, default):
+
+    # Very old Tests might not have parsable values
+    try: return int(extract_option(options, option))
+    except (TypeError, ValueError): return default
+
+def uses_time(time_control):
+    return not time_control.startswith('N=') and not time_control.startswith('D=')
+
+def set_workload_requirements(apps, schema_editor):
+
+    Test = apps.get_model('OpenBench', 'Test')
+
+    tests = list(Test.objects.all())
+
+    for test in tests:
+
+        test.dev_threads   = option_as_int(test.dev_options,  'Threads', 1)
+        test.base_threads  = option_as_int(test.base_options, 'Threads', 1)
+        test.max_threads   = max(test.dev_threads, test.base_threads)
+
+        test.hash_mb       = option_as_int(test.dev_options,  'Hash', 0) \
+                           + option_as_int(test.base_options, 'Hash', 0)
+
+        test.time_based    = test.upload_pgns == 'VERBOSE' \
+                          or uses_time(test.dev_time_control) or uses_time(test.base_time_control)
+
+        test.syzygy_pieces = max(
+            [int(x.split('-')[0]) for x in (test.syzygy_wdl, test.syzygy_adj) if x.endswith('-MAN')], default=0)
+
+    fields = ['dev_threads', 'base_threads', 'max_threads', 'hash_mb', 'time_based', 'syzygy_pieces']
+    Test.objects.bulk_update(tests, fields, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('OpenBench', '0011_normalize_engine_source'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='test',
+            name='base_threads',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='test',
+            name='dev_threads',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='test',
+            name='hash_mb',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='test',
+            name='max_threads',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='test',
+            name='syzygy_pieces',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='test',
+            name='time_based',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='test',
+            index=models.Index(fields=['approved', 'finished', 'deleted', 'priority', 'max_threads', 'syzygy_pieces'], name='OpenBench_t_approve_7f6b3f_idx'),
+        ),
+        migrations.RunPython(set_workload_requirements, migrations.RunPython.noop),
+    ]
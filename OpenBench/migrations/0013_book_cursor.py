@@ -0,0 +1,49 @@
+# Generated by Django 4.2.1 on 2026-10-17 07:20
+#
+# Move each Test's book_index into its own BookCursor row, so that handing
+# out openings no longer locks the Test row which results are applied to.
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+def create_book_cursors(apps, schema_editor):
+
+    Test       = apps.get_model('OpenBench', 'Test')
+    BookCursor = apps.get_model('OpenBench', 'BookCursor')
+
+    cursors = [
+        BookCursor(test_id=test_id, index=book_index)
+            for test_id, book_index in Test.objects.values_list('id', 'book_index')
+    ]
+
+    BookCursor.objects.bulk_create(cursors, batch_size=500)
+
+def restore_book_index(apps, schema_editor):
+
+    Test       = apps.get_model('OpenBench', 'Test')
+    BookCursor = apps.get_model('OpenBench', 'BookCursor')
+
+    for test_id, index in BookCursor.objects.values_list('test_id', 'index'):
+        Test.objects.filter(id=test_id).update(book_index=index)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('OpenBench', '0012_test_workload_requirements'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookCursor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField(default=1)),
+                ('test', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='book_cursor', to='OpenBench.test')),
+            ],
+        ),
+        migrations.RunPython(create_book_cursors, restore_book_index),
+        migrations.RemoveField(
+            model_name='test',
+            name='book_index',
+        ),
+    ]
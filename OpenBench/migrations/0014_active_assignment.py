@@ -0,0 +1,52 @@
+# Generated by Django 4.2.1 on 2026-10-17 07:24
+#
+# Denormalize what each Machine is working on into ActiveAssignment rows, so
+# that the scheduler and status views need not parse Machine.info JSON.
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+def create_active_assignments(apps, schema_editor):
+
+    Machine          = apps.get_model('OpenBench', 'Machine')
+    ActiveAssignment = apps.get_model('OpenBench', 'ActiveAssignment')
+
+    assignments = [
+        ActiveAssignment(
+            machine_id = machine.id,
+            user_id    = machine.user_id,
+            test_id    = machine.workload,
+            threads    = machine.info.get('concurrency', 0),
+            sockets    = machine.info.get('sockets', 1),
+            mnps       = machine.mnps,
+            focus      = machine.info.get('focus', []),
+            last_seen  = machine.updated,
+        ) for machine in Machine.objects.filter(workload__gt=0)
+    ]
+
+    ActiveAssignment.objects.bulk_create(assignments, batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('OpenBench', '0013_book_cursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActiveAssignment',
+            fields=[
+                ('machine', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='assignment', serialize=False, to='OpenBench.machine')),
+                ('test_id', models.IntegerField(db_index=True, default=0)),
+                ('threads', models.IntegerField(default=0)),
+                ('sockets', models.IntegerField(default=1)),
+                ('mnps', models.FloatField(default=0.0)),
+                ('focus', models.JSONField(blank=True, default=list)),
+                ('last_seen', models.DateTimeField(db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='assignments', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(create_active_assignments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.1 on 2026-10-17 07:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('OpenBench', '0014_active_assignment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultJournal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('test_id', models.IntegerField(db_index=True)),
+                ('delta', models.JSONField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
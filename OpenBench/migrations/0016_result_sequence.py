@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-17 07:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('OpenBench', '0015_result_journal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='sequence',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.1 on 2026-10-17 07:42
+#
+# Record the owner of each Result's Machine on the Result itself, so that crediting
+# a Profile with games no longer needs to lock and read the Machine row.
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+def set_result_users(apps, schema_editor):
+
+    Machine = apps.get_model('OpenBench', 'Machine')
+    Result  = apps.get_model('OpenBench', 'Result')
+
+    owners = Machine.objects.filter(id=OuterRef('machine_id')).values('user_id')[:1]
+    Result.objects.update(user_id=Subquery(owners))
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('OpenBench', '0016_result_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='results', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(set_result_users, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='result',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='results', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
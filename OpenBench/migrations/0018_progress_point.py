@@ -0,0 +1,31 @@
+# Generated by Django 4.2.1 on 2026-10-17 07:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('OpenBench', '0017_result_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProgressPoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('test_id', models.IntegerField()),
+                ('timestamp', models.DateTimeField()),
+                ('games', models.IntegerField()),
+                ('llr', models.FloatField()),
+                ('LL', models.IntegerField()),
+                ('LD', models.IntegerField()),
+                ('DD', models.IntegerField()),
+                ('DW', models.IntegerField()),
+                ('WW', models.IntegerField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['test_id', 'timestamp'], name='OpenBench_p_test_id_c50de7_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.1 on 2026-10-17 07:58
+#
+# Pack every SPSAParameter's constants and current value into vectors on the SPSARun,
+# so that assignment and updates read and write a single row.
+
+from django.db import migrations, models
+import numpy as np
+
+SPSA_CONSTANTS = ['min_value', 'max_value', 'a_value', 'c_value', 'is_float', 'start', 'c_end', 'r_end']
+
+def pack_spsa_runs(apps, schema_editor):
+
+    SPSARun       = apps.get_model('OpenBench', 'SPSARun')
+    SPSAParameter = apps.get_model('OpenBench', 'SPSAParameter')
+
+    for spsa_run in SPSARun.objects.all():
+
+        params = list(SPSAParameter.objects.filter(spsa_run=spsa_run).order_by('index'))
+        values = np.array([param.value for param in params], dtype=float)
+
+        spsa_run.names     = [param.name for param in params]
+        spsa_run.constants = np.array([[getattr(param, x) for param in params] for x in SPSA_CONSTANTS], dtype='<f8').tobytes()
+        spsa_run.values    = np.asarray(values, dtype='<f8').tobytes()
+        spsa_run.save(update_fields=['names', 'constants', 'values'])
+
+def unpack_spsa_runs(apps, schema_editor):
+
+    SPSARun       = apps.get_model('OpenBench', 'SPSARun')
+    SPSAParameter = apps.get_model('OpenBench', 'SPSAParameter')
+
+    for spsa_run in SPSARun.objects.all():
+
+        params = list(SPSAParameter.objects.filter(spsa_run=spsa_run).order_by('index'))
+        for param, value in zip(params, np.frombuffer(bytes(spsa_run.values), dtype='<f8')):
+            param.value = float(value)
+
+        SPSAParameter.objects.bulk_update(params, ['value'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('OpenBench', '0018_progress_point'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spsarun',
+            name='constants',
+            field=models.BinaryField(default=bytes),
+        ),
+        migrations.AddField(
+            model_name='spsarun',
+            name='names',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name='spsarun',
+            name='values',
+            field=models.BinaryField(default=bytes),
+        ),
+        migrations.RunPython(pack_spsa_runs, unpack_spsa_runs),
+    ]
@@ -16,14 +16,15 @@ def workload_to_dict(workload):
     nested = ['dev', 'base', 'losses', 'draws', 'wins', 'LL', 'LD', 'DD', 'DW', 'WW']
 
     return {
-        'id'       : workload.id,
+        'id'         : workload.id,
         **model_to_dict(workload, exclude=['id'] + nested),
-        'dev'      : engine_to_dict(workload.dev),
-        'base'     : engine_to_dict(workload.base),
-        'tri'      : workload.as_tri(),
-        'penta'    : workload.as_penta(),
-        'creation' : str(workload.creation),
-        'updated'  : str(workload.updated),
+        'book_index' : workload.book_cursor.index,
+        'dev'        : engine_to_dict(workload.dev),
+        'base'       : engine_to_dict(workload.base),
+        'tri'        : workload.as_tri(),
+        'penta'      : workload.as_penta(),
+        'creation'   : str(workload.creation),
+        'updated'    : str(workload.updated),
     }
 
 def network_delete(network) -> (str, bool):
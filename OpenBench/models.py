@@ -19,8 +19,8 @@
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 from django.db.models import CharField, IntegerField, BigIntegerField, BooleanField, FloatField
-from django.db.models import JSONField, ForeignKey, DateTimeField, OneToOneField
-from django.db.models import CASCADE, PROTECT, Model, TextChoices
+from django.db.models import JSONField, ForeignKey, DateTimeField, OneToOneField, BinaryField
+from django.db.models import CASCADE, PROTECT, Model, TextChoices, Index
 from django.contrib.auth.models import User
 
 class Engine(Model):
@@ -61,10 +61,28 @@ class Machine(Model):
     def __str__(self):
         return '[%d] %s' % (self.id, self.user.username)
 
+class ActiveAssignment(Model):
+
+    # What each Machine was last seen working on, denormalized from the Machine
+    # and its info, so that the scheduler and status views need not parse JSON
+
+    machine   = OneToOneField(Machine, CASCADE, primary_key=True, related_name='assignment')
+    user      = ForeignKey(User, CASCADE, related_name='assignments')
+    test_id   = IntegerField(default=0, db_index=True)
+    threads   = IntegerField(default=0)
+    sockets   = IntegerField(default=1)
+    mnps      = FloatField(default=0.00)
+    focus     = JSONField(default=list, blank=True)
+    last_seen = DateTimeField(db_index=True)
+
+    def __str__(self):
+        return '[%d] %d' % (self.machine_id, self.test_id)
+
 class Result(Model):
 
     test     = ForeignKey('Test', PROTECT, related_name='test')
     machine  = ForeignKey('Machine', PROTECT, related_name='machine')
+    user     = ForeignKey(User, PROTECT, related_name='results') # Owner of the Machine
     updated  = DateTimeField(auto_now=True)
 
     # Trinomial Distributions
@@ -84,6 +102,9 @@ class Result(Model):
     crashes  = IntegerField(default=0)
     timeloss = IntegerField(default=0)
 
+    # Latest submission applied, to discard any resent by the Client
+    sequence = BigIntegerField(default=0)
+
     def __str__(self):
         return '{0} {1}'.format(self.test.dev.name, self.machine.__str__())
 
@@ -99,9 +120,8 @@ class Test(Model):
     upload_pgns = CharField(max_length=16, default='FALSE')
     info        = CharField(max_length=1024, default='', blank=True)
 
-    # Opening book settings
+    # Opening book settings, with the next opening to use held in a BookCursor
     book_name  = CharField(max_length=32)
-    book_index = IntegerField(default=1)
 
     # Dev Engine, and all of its settings
     dev              = ForeignKey('Engine', PROTECT, related_name='dev')
@@ -136,6 +156,14 @@ class Test(Model):
     win_adj     = CharField(max_length=64, default='movecount=3 score=400')
     draw_adj    = CharField(max_length=64, default='movenumber=40 movecount=8 score=10')
 
+    # Requirements derived from the above, via set_workload_requirements()
+    dev_threads   = IntegerField(default=1)
+    base_threads  = IntegerField(default=1)
+    max_threads   = IntegerField(default=1)
+    hash_mb       = IntegerField(default=0)     # Combined Hash of both engines
+    time_based    = BooleanField(default=False) # Uses, or measures, Time
+    syzygy_pieces = IntegerField(default=0)     # Largest N-MAN from syzygy_wdl and syzygy_adj
+
     # Test Mode specific values, either SPRT, GAMES, SPSA, or DATAGEN
     test_mode     = CharField(max_length=16, default='SPRT')
     elolower      = FloatField(default=0.0) # SPRT
@@ -176,6 +204,11 @@ class Test(Model):
     creation    = DateTimeField(auto_now_add=True)
     updated     = DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            Index(fields=['approved', 'finished', 'deleted', 'priority', 'max_threads', 'syzygy_pieces']),
+        ]
+
     def __str__(self):
         return '{0} vs {1} @ {2}'.format(self.dev.name, self.base.name, self.dev_time_control)
 
@@ -234,6 +267,17 @@ class PGN(Model):
     def filename(self):
         return '%s.%s.%s.pgn.bz2' % (self.test_id, self.result_id, self.book_index)
 
+class BookCursor(Model):
+
+    # Kept apart from the Test, so that handing out openings never waits on a
+    # lock of the Test row, which is held while results are being applied
+
+    test  = OneToOneField(Test, on_delete=CASCADE, related_name='book_cursor')
+    index = IntegerField(default=1)
+
+    def __str__(self):
+        return '{0} @ {1}'.format(self.test_id, self.index)
+
 class SPSARun(Model):
 
     class SPSAReportingType(TextChoices):
@@ -255,12 +299,17 @@ class SPSARun(Model):
     pairs_per  = IntegerField()
     a_ratio    = FloatField()
 
+    # Packed float64 vectors, ordered by SPSAParameter index. See spsa_utils.SPSA_CONSTANTS
+    names     = JSONField(default=list)
+    constants = BinaryField(default=bytes)
+    values    = BinaryField(default=bytes) # Only field that changes
+
 class SPSAParameter(Model):
 
     spsa_run  = ForeignKey(SPSARun, on_delete=CASCADE, related_name='parameters')
     name      = CharField(max_length=64)
     index     = IntegerField()
-    value     = FloatField() # Only field that changes
+    value     = FloatField() # Copied from SPSARun.values once finished
 
     is_float  = BooleanField() # Constants
     start     = FloatField()
@@ -271,3 +320,38 @@ class SPSAParameter(Model):
 
     c_value   = FloatField() # Constants pre-computed for speed
     a_value   = FloatField()
+
+class ResultJournal(Model):
+
+    # Results which were acknowledged, but not yet applied, when using aggregate_results
+
+    test_id = IntegerField(db_index=True)
+    delta   = JSONField()
+    created = DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return '[{}] {}'.format(self.test_id, self.created)
+
+class ProgressPoint(Model):
+
+    # Totals of a Test at a moment in time. Thinned as they age, by compact_progress()
+
+    test_id   = IntegerField()
+    timestamp = DateTimeField()
+    games     = IntegerField()
+    llr       = FloatField()
+
+    # Pentanomial Distributions
+    LL = IntegerField()
+    LD = IntegerField()
+    DD = IntegerField()
+    DW = IntegerField()
+    WW = IntegerField()
+
+    class Meta:
+        indexes = [
+            Index(fields=['test_id', 'timestamp']),
+        ]
+
+    def __str__(self):
+        return '[{}] {} games at {}'.format(self.test_id, self.games, self.timestamp)
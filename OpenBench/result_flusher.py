@@ -0,0 +1,102 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#                                                                             #
+#   OpenBench is a chess engine testing framework authored by Andrew Grant.   #
+#   <https://github.com/AndyGrant/OpenBench>           <andrew@grantnet.us>   #
+#                                                                             #
+#   OpenBench is free software: you can redistribute it and/or modify         #
+#   it under the terms of the GNU General Public License as published by      #
+#   the Free Software Foundation, either version 3 of the License, or         #
+#   (at your option) any later version.                                       #
+#                                                                             #
+#   OpenBench is distributed in the hope that it will be useful,              #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#   GNU General Public License for more details.                              #
+#                                                                             #
+#   You should have received a copy of the GNU General Public License         #
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import sys
+import threading
+import traceback
+
+import OpenBench.utils
+
+from OpenBench.models import ResultJournal
+
+from django.db import close_old_connections, transaction
+
+# Seconds between passes over the ResultJournal, and max entries handled per pass.
+# Tests are finished at most one interval after the results that finish them arrive.
+FLUSH_INTERVAL   = 0.25
+FLUSH_BATCH_SIZE = 1024
+
+class ResultFlusher(threading.Thread):
+
+    def __init__(self, stop_event, *args, **kwargs):
+        self.stop_event = stop_event
+        super().__init__(*args, **kwargs)
+
+    def process_test(self, test_id, entries):
+
+        # Apply every pending delta for the test at once, and drop them from the journal
+        # in the same transaction, so that each is applied exactly once
+
+        with transaction.atomic():
+            OpenBench.utils.apply_result_deltas(test_id, [entry.delta for entry in entries])
+            ResultJournal.objects.filter(pk__in=[entry.pk for entry in entries]).delete()
+
+    def process_pending(self):
+
+        # Bounded slice, in order of arrival, so each test's deltas are applied in order
+        entries = list(ResultJournal.objects.order_by('id')[:FLUSH_BATCH_SIZE])
+
+        groups = {}
+        for entry in entries:
+            groups.setdefault(entry.test_id, []).append(entry)
+
+        # Failures are kept to their own test, so one bad entry cannot stall the rest
+        for test_id, group in groups.items():
+            try: self.process_test(test_id, group)
+            except Exception as error:
+                self.process_failed(test_id, group, error)
+
+        return len(entries)
+
+    def process_failed(self, test_id, entries, error):
+
+        # Expect the database to be locked sometimes; retry on the next pass
+        if 'database is locked' in str(error).lower():
+            return
+
+        # Otherwise apply the entries one at a time, and discard any that fail alone,
+        # since they would fail again on every pass, ahead of everything after them
+        for entry in entries:
+            try: self.process_test(test_id, [entry])
+            except Exception:
+                traceback.print_exc()
+                print ('[Error] Discarding ResultJournal entry: %s' % (entry.delta))
+                sys.stdout.flush()
+                ResultJournal.objects.filter(pk=entry.pk).delete()
+
+    def run(self):
+
+        # Loop until we are shutdown by the atexit.register()
+        while not self.stop_event.is_set():
+
+            try: # Never exit on errors, to keep the flusher alive
+                handled = self.process_pending()
+
+            except Exception as error:
+                handled = 0
+                # Expect the database to be locked sometimes; stay silent
+                if 'database is locked' not in str(error).lower():
+                    traceback.print_exc()
+                    sys.stdout.flush()
+                    close_old_connections()
+
+            # Loop again immediately while draining a backlog
+            if handled < FLUSH_BATCH_SIZE:
+                self.stop_event.wait(timeout=FLUSH_INTERVAL)
@@ -0,0 +1,276 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#                                                                             #
+#   OpenBench is a chess engine testing framework authored by Andrew Grant.   #
+#   <https://github.com/AndyGrant/OpenBench>           <andrew@grantnet.us>   #
+#                                                                             #
+#   OpenBench is free software: you can redistribute it and/or modify         #
+#   it under the terms of the GNU General Public License as published by      #
+#   the Free Software Foundation, either version 3 of the License, or         #
+#   (at your option) any later version.                                       #
+#                                                                             #
+#   OpenBench is distributed in the hope that it will be useful,              #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of            #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the             #
+#   GNU General Public License for more details.                              #
+#                                                                             #
+#   You should have received a copy of the GNU General Public License         #
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.     #
+#                                                                             #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# Process-level snapshot of everything select_workload() needs to know, so that
+# workload assignment can be done in memory rather than by re-reading every active
+# Test and every recent Machine on each request. The snapshot is refreshed in place
+# when Tests are created, modified, or finished, and when Machines report in.
+#
+# Every process holds its own snapshot, and cannot observe changes made by another
+# process. Machines are assigned by every process, so the assignments are reloaded
+# from the ActiveAssignment table every ASSIGNMENT_LIFETIME seconds, which keeps the
+# thread totals of each process close to those of the rest of the server. Tests are
+# changed far less often, and are rebuilt only every SNAPSHOT_LIFETIME seconds.
+#
+# Refer to: https://github.com/AndyGrant/OpenBench/wiki/Workload-Assignment
+
+import threading
+import time
+
+from collections import OrderedDict
+
+import OpenBench.utils
+
+from django.utils import timezone
+
+from OpenBench.config import OPENBENCH_CONFIG
+from OpenBench.models import ActiveAssignment
+
+SNAPSHOT_LIFETIME   = 60  # Seconds between full rebuilds from the database
+ASSIGNMENT_LIFETIME = 2   # Seconds between reloads of the assignments made by every process
+MACHINE_LIFETIME    = 120 # Seconds before a silent Machine is dropped, as in getRecentAssignments()
+
+REQUIREMENT_FIELDS = [
+    'id', 'priority', 'throughput', 'test_mode', 'dev_engine', 'base_engine', 'scale_nps',
+    'dev_threads', 'base_threads', 'max_threads', 'hash_mb', 'time_based', 'syzygy_pieces',
+    'dev_network', 'base_network',
+]
+
+def engine_binary_name(engine, commit_sha, network):
+
+    # Matches the naming of Engines/ by the Client's utils.engine_binary_name()
+
+    name = '%s-%s' % (engine, commit_sha.upper()[:8])
+    if network:
+        name += '-%s' % (network[-8:])
+    return name
+
+def test_is_active(test):
+    return test.approved and not test.finished and not test.deleted
+
+def test_requirements(test):
+
+    # Everything needed to decide if a Machine may play a Test
+
+    requirements = { field : getattr(test, field) for field in REQUIREMENT_FIELDS }
+
+    # Binaries and Networks, which a Machine might already have on hand
+    requirements['binaries'] = {
+        engine_binary_name(test.dev_engine , test.dev.sha , test.dev_network ),
+        engine_binary_name(test.base_engine, test.base.sha, test.base_network),
+    }
+    requirements['networks'] = { x for x in (test.dev_network, test.base_network) if x }
+
+    return requirements
+
+def machine_assignment(assignment):
+
+    # Everything needed to account for the threads a Machine is contributing
+
+    return {
+        'id'      : assignment.machine_id,
+        'test'    : assignment.test_id,
+        'threads' : assignment.threads,
+        'mnps'    : assignment.mnps,
+        'focus'   : assignment.focus,
+        'seen'    : assignment.last_seen.timestamp(),
+    }
+
+def machine_seen(machine):
+
+    # Record what the Machine is working on, for every process, and for this Snapshot
+
+    fields = {
+        'user_id'   : machine.user_id,
+        'test_id'   : machine.workload,
+        'threads'   : machine.info['concurrency'],
+        'sockets'   : machine.info.get('sockets', 1),
+        'mnps'      : machine.mnps,
+        'focus'     : machine.info.get('focus', []),
+        'last_seen' : timezone.now(),
+    }
+
+    if not ActiveAssignment.objects.filter(machine_id=machine.id).update(**fields):
+        ActiveAssignment.objects.create(machine_id=machine.id, **fields)
+
+    SNAPSHOT.update_machine(ActiveAssignment(machine_id=machine.id, **fields))
+
+def relative_speed(mnps, test):
+
+    # Speed of a Machine, relative to the reference speed of the engines it is playing
+
+    if not mnps or not test or not test['scale_nps']:
+        return None
+
+    return mnps * 1e6 / test['scale_nps']
+
+def weighted_threads(threads, mnps, test):
+
+    # With weight_machines_by_nps, scale threads by the Machine's relative speed.
+    # Machines that have yet to report their speed for the current Test are
+    # counted as running at the reference speed
+
+    if not OPENBENCH_CONFIG['weight_machines_by_nps'] or not (speed := relative_speed(mnps, test)):
+        return threads
+
+    return threads * speed
+
+class SchedulerSnapshot:
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        self.built    = 0             # time.time() of the last full rebuild
+        self.loaded   = 0             # time.time() of the last reload of the assignments
+        self.tests    = {}            # Test id -> test_requirements()
+        self.reset_machines()
+
+    def reset_machines(self):
+        self.machines = OrderedDict() # Machine id -> machine_assignment(), least recently seen first
+        self.assigned = {}            # Test id -> { 'threads', 'focused', 'machines' } summed over self.machines
+
+    def rebuild(self):
+
+        with self.lock:
+
+            self.reset()
+            self.built = time.time()
+
+            tests = OpenBench.utils.get_active_tests().select_related('dev', 'base')
+            for test in tests.only(*REQUIREMENT_FIELDS, 'dev__sha', 'base__sha'):
+                self.tests[test.id] = test_requirements(test)
+
+            self.reload_machines()
+
+    def reload_machines(self):
+
+        # Assignments made by every process, in one query against the indexed last_seen
+
+        with self.lock:
+
+            self.reset_machines()
+            self.loaded = time.time()
+
+            for assignment in OpenBench.utils.getRecentAssignments().order_by('last_seen'):
+                self.attach(machine_assignment(assignment))
+
+    def refresh(self):
+
+        # Rebuild once stale, reload the assignments of other processes once those are
+        # stale, and otherwise only expire Machines that went silent
+
+        with self.lock:
+
+            if self.built + SNAPSHOT_LIFETIME < time.time():
+                self.rebuild()
+
+            elif self.loaded + ASSIGNMENT_LIFETIME < time.time():
+                self.reload_machines()
+
+            cutoff = time.time() - MACHINE_LIFETIME
+            while self.machines and next(iter(self.machines.values()))['seen'] < cutoff:
+                self.detach(next(iter(self.machines.values())))
+
+    def update_test(self, test):
+
+        with self.lock:
+
+            # Machines on this Test have to be recounted, as focus depends on the engine
+            on_test = [x for x in self.machines.values() if x['test'] == test.id]
+            for assignment in on_test:
+                self.detach(assignment)
+
+            if test_is_active(test):
+                self.tests[test.id] = test_requirements(test)
+            else:
+                self.tests.pop(test.id, None)
+
+            for assignment in on_test:
+                self.attach(assignment)
+
+    def discard_test(self, test_id):
+
+        with self.lock:
+            self.tests.pop(test_id, None)
+
+    def update_machine(self, assignment):
+
+        with self.lock:
+
+            if assignment.machine_id in self.machines:
+                self.detach(self.machines[assignment.machine_id])
+
+            self.attach(machine_assignment(assignment))
+
+    def attach(self, assignment):
+
+        test    = self.tests.get(assignment['test'])
+        totals  = self.assigned.setdefault(assignment['test'], { 'threads' : 0, 'focused' : 0, 'machines' : 0 })
+        focused = bool(test) and test['dev_engine'] in assignment['focus']
+        weight  = weighted_threads(assignment['threads'], assignment['mnps'], test)
+
+        totals['threads'] += weight
+        totals['focused'] += weight if focused else 0
+        totals['machines'] += 1
+
+        assignment['focused'] = focused
+        assignment['weight' ] = weight
+        self.machines[assignment['id']] = assignment
+
+    def detach(self, assignment):
+
+        totals = self.assigned[assignment['test']]
+        totals['threads'] -= assignment['weight']
+        totals['focused'] -= assignment['weight'] if assignment['focused'] else 0
+        totals['machines'] -= 1
+
+        if not totals['machines']:
+            del self.assigned[assignment['test']]
+
+        del self.machines[assignment['id']]
+
+    def active_tests(self):
+        return list(self.tests.values())
+
+    def assigned_threads(self, test_id, has_focus, machine_id):
+
+        # Weighted threads on the Test, ignoring the requesting Machine, and
+        # ignoring focus-assigned Machines when the requesting Machine has no focus
+
+        totals  = self.assigned.get(test_id, { 'threads' : 0, 'focused' : 0 })
+        threads = totals['threads'] if has_focus else totals['threads'] - totals['focused']
+
+        if (own := self.machines.get(machine_id)) and own['test'] == test_id:
+            if has_focus or not own['focused']:
+                threads -= own['weight']
+
+        return threads
+
+    def machine_speed(self, machine):
+        return relative_speed(machine.mnps, self.tests.get(machine.workload))
+
+    def machine_weight(self, machine):
+
+        # Weighted threads the Machine would contribute to any Test
+        return weighted_threads(machine.info['concurrency'], machine.mnps, self.tests.get(machine.workload))
+
+SNAPSHOT = SchedulerSnapshot()
@@ -18,9 +18,37 @@
 #                                                                             #
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
+import atexit
+import threading
+import time
+
 import numpy as np
 
-from OpenBench.models import SPSARun, SPSAParameter
+from django.db import transaction
+
+from OpenBench.models import SPSARun, SPSAParameter, Test
+
+# Rows of SPSARun.constants, each a vector ordered by SPSAParameter index
+SPSA_CONSTANTS = ['min_value', 'max_value', 'a_value', 'c_value', 'is_float', 'start', 'c_end', 'r_end']
+
+# Deltas are buffered per process, and applied to SPSARun.values in periodic batches
+SPSA_FLUSH_INTERVAL = 5.0 # Seconds that deltas may be buffered before being applied
+SPSA_BUFFERS        = {}  # Test id -> { 'created', 'shift', 'lower', 'upper' }
+SPSA_BUFFER_LOCK    = threading.Lock()
+
+def spsa_pack(vector):
+    return np.asarray(vector, dtype='<f8').tobytes()
+
+def spsa_unpack(blob):
+    return np.frombuffer(bytes(blob), dtype='<f8')
+
+def spsa_constants(spsa_run):
+
+    constants = spsa_unpack(spsa_run.constants).reshape(len(SPSA_CONSTANTS), -1)
+    constants = dict(zip(SPSA_CONSTANTS, constants))
+
+    constants['is_float'] = constants['is_float'].astype(bool)
+    return constants
 
 def spsa_original_input(workload):
 
@@ -39,9 +67,14 @@ def spsa_original_input(workload):
     return '\n'.join(lines)
 
 def spsa_optimal_values(workload):
+
+    spsa_run  = workload.spsa_run
+    values    = spsa_unpack(spsa_run.values)
+    is_float  = spsa_constants(spsa_run)['is_float']
+
     return '\n'.join([
-        '%s, %s' % (param.name, param.value if param.is_float else int(round(param.value)))
-        for param in workload.spsa_run.parameters.order_by('index')
+        '%s, %s' % (name, float(value) if is_float[i] else int(round(value)))
+        for i, (name, value) in enumerate(zip(spsa_run.names, values))
     ])
 
 def create_spsa_run(workload, request):
@@ -87,6 +120,12 @@ def create_spsa_run(workload, request):
         ))
 
     SPSAParameter.objects.bulk_create(params)
+
+    # Packed copies of every Parameter, used for assignment and updates
+    spsa_run.names     = [param.name for param in params]
+    spsa_run.constants = spsa_pack([[getattr(param, x) for param in params] for x in SPSA_CONSTANTS])
+    spsa_run.values    = spsa_pack([param.value for param in params])
+
     return spsa_run
 
 def spsa_param_digest(workload):
@@ -100,23 +139,27 @@ def spsa_param_digest(workload):
     # If these headers are changed here, they should be changed in Templates/OpenBench/workload.html
     digest = [['Name', 'Curr', 'Start', 'Min', 'Max', 'C', 'C_end', 'R', 'R_end']]
 
-    for param in spsa_run.parameters.order_by('index'):
+    constants = spsa_constants(spsa_run)
+    values    = spsa_unpack(spsa_run.values)
+
+    # C and R if we got a workload right now
+    c_values = np.maximum(constants['c_value'] / c_compression, np.where(constants['is_float'], 0.0, 0.5))
+    r_values = constants['a_value'] / r_compression / c_values ** 2
+
+    for i, name in enumerate(spsa_run.names):
 
-        # C and R if we got a workload right now
-        c    = max(param.c_value / c_compression, 0.00 if param.is_float else 0.50)
-        r    = param.a_value / r_compression / c ** 2
-        fstr = '%.4f' if param.is_float else '%d'
+        fstr = '%.4f' if constants['is_float'][i] else '%d'
 
         digest.append([
-            param.name,
-            '%.4f' % (param.value),
-            fstr   % (param.start),
-            fstr   % (param.min_value),
-            fstr   % (param.max_value),
-            '%.4f' % (c),
-            '%.4f' % (param.c_end),
-            '%.4f' % (r),
-            '%.4f' % (param.r_end),
+            name,
+            '%.4f' % (values[i]),
+            fstr   % (constants['start'][i]),
+            fstr   % (constants['min_value'][i]),
+            fstr   % (constants['max_value'][i]),
+            '%.4f' % (c_values[i]),
+            '%.4f' % (constants['c_end'][i]),
+            '%.4f' % (r_values[i]),
+            '%.4f' % (constants['r_end'][i]),
         ])
 
     return '\n'.join([','.join(f) for f in digest])
@@ -126,15 +169,15 @@ def spsa_workload_assignment_dict(workload, runner_count):
     if workload.test_mode != 'SPSA':
         return None
 
-    params = list(workload.spsa_run.parameters.order_by('index'))
+    constants = spsa_constants(workload.spsa_run)
 
-    names    = [p.name for p in params]
-    values   = np.array([p.value     for p in params])
-    mins     = np.array([p.min_value for p in params])
-    maxs     = np.array([p.max_value for p in params])
-    a_values = np.array([p.a_value   for p in params])
-    c_values = np.array([p.c_value   for p in params]) # Scaled later
-    is_float = np.array([p.is_float  for p in params])
+    names    = workload.spsa_run.names
+    values   = spsa_unpack(workload.spsa_run.values)
+    mins     = constants['min_value']
+    maxs     = constants['max_value']
+    a_values = constants['a_value']
+    c_values = constants['c_value'] # Scaled later
+    is_float = constants['is_float']
 
     # Only use one set of parameters if distribution is SINGLE.
     # Duplicate the params, even though they are the same, across all
@@ -154,7 +197,7 @@ def spsa_workload_assignment_dict(workload, runner_count):
     r_values = a_values / r_compression / c_values**2
 
     # Apply flips for each parameter, for each permutation
-    flips = np.random.choice([-1, 1], size=(len(params), permutations))
+    flips = np.random.choice([-1, 1], size=(len(names), permutations))
     devs  = values[:, None] + flips * c_values[:, None]
     bases = values[:, None] - flips * c_values[:, None]
 
@@ -163,7 +206,7 @@ def spsa_workload_assignment_dict(workload, runner_count):
     mask_int = np.broadcast_to(mask_int, devs.shape) # shape (num_params, permutations)
 
     # Probabilistic rounding for integer parameters
-    rand_mat = np.random.rand(len(params), permutations)
+    rand_mat = np.random.rand(len(names), permutations)
     devs[mask_int]  = np.floor(devs[mask_int]  + rand_mat[mask_int])
     bases[mask_int] = np.floor(bases[mask_int] + rand_mat[mask_int])
 
@@ -186,3 +229,77 @@ def spsa_workload_assignment_dict(workload, runner_count):
             'r'     : float(r_values[i]),
         } for i, name in enumerate(names)
     }
+
+def spsa_apply_deltas(spsa_run, spsa_deltas, finished):
+
+    # Buffer the updates, and apply them once the buffer is old enough, or the tune is over
+    spsa_buffer_deltas(spsa_run, spsa_deltas)
+    spsa_flush_deltas(spsa_run.tune_id, spsa_run, force=finished)
+
+    # Each SPSAParameter keeps a copy of its final value
+    if finished:
+        values = spsa_unpack(spsa_run.values)
+        params = list(spsa_run.parameters.order_by('index'))
+        for param, value in zip(params, values):
+            param.value = float(value)
+        SPSAParameter.objects.bulk_update(params, ['value'])
+
+def spsa_buffer_deltas(spsa_run, spsa_deltas):
+
+    # Each submission moves the values by x -> clip(x + delta, min, max). Any sequence of
+    # those is itself x -> clip(x + shift, lower, upper), so the buffer keeps only that.
+    # Applying the buffer later is then identical to clipping one submission at a time
+
+    if not (spsa_deltas := list(filter(None, spsa_deltas))):
+        return
+
+    constants = spsa_constants(spsa_run)
+    mins      = constants['min_value']
+    maxs      = constants['max_value']
+
+    with SPSA_BUFFER_LOCK:
+
+        buffer = SPSA_BUFFERS.setdefault(spsa_run.tune_id, {
+            'created' : time.time(),
+            'shift'   : np.zeros(len(mins)),
+            'lower'   : np.full(len(mins), -np.inf),
+            'upper'   : np.full(len(mins), +np.inf),
+        })
+
+        for spsa_delta in spsa_deltas:
+            delta = np.zeros(len(mins))
+            delta[:len(spsa_delta)] = spsa_delta[:len(mins)]
+            buffer['shift'] = buffer['shift'] + delta
+            buffer['lower'] = np.clip(buffer['lower'] + delta, mins, maxs)
+            buffer['upper'] = np.clip(buffer['upper'] + delta, mins, maxs)
+
+def spsa_flush_deltas(test_id, spsa_run=None, force=False):
+
+    # Apply the buffered deltas of a tune to SPSARun.values, when old enough, or forced.
+    # Must be called while holding the lock on the Test, as apply_result_deltas() does
+
+    with SPSA_BUFFER_LOCK:
+
+        buffer = SPSA_BUFFERS.get(test_id)
+        if not buffer or (not force and buffer['created'] + SPSA_FLUSH_INTERVAL > time.time()):
+            return
+
+        del SPSA_BUFFERS[test_id]
+
+    spsa_run = spsa_run or SPSARun.objects.get(tune_id=test_id)
+    values   = spsa_unpack(spsa_run.values)
+    values   = np.clip(values + buffer['shift'], buffer['lower'], buffer['upper'])
+
+    spsa_run.values = spsa_pack(values)
+    spsa_run.save(update_fields=['values'])
+
+def spsa_flush_all():
+
+    # Apply everything still buffered when the process exits, taking each Test's lock
+
+    for test_id in list(SPSA_BUFFERS.keys()):
+        with transaction.atomic():
+            Test.objects.select_for_update().filter(id=test_id).first()
+            spsa_flush_deltas(test_id, force=True)
+
+atexit.register(spsa_flush_all)
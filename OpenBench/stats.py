@@ -21,15 +21,38 @@
 # The implementation for PentanomialSPRT is taken directly from Fishtest.
 # The implementation for TrinomialSPRT was derived directory from Fishtest.
 #
-# Only three functions should be used externally from this Module.
+# Only four functions should be used externally from this Module.
 # 1. llr = TrinomialSPRT([losses, draws, wins], elo0, elo1)
-# 2. llr = PentanomialSPRT([ll, ld, dd, dw, ww], elo0, elo1)
-# 3. lower, elo, upper = Elo((L, D, W) or (LL, LD, DD/WL, DW, WW))
+# 2. llr = PentanomialSPRT([ll, ld, dd, dw, ww], elo0, elo1, key=None)
+# 3. llrs = PentanomialSPRTBatch([[ll, ld, dd, dw, ww], ...], elo0s, elo1s)
+# 4. lower, elo, upper = Elo((L, D, W) or (LL, LD, DD/WL, DW, WW))
+#
+# PentanomialSPRT() may be given a key, such as a Test's id, in which case the MLE
+# solutions are kept, and used as the starting point for the next call with that key.
+# Between submissions the results barely move, so few iterations are then needed.
+#
+# PentanomialSPRTBatch() solves for many rows at once using NumPy, by way of
+# MLE_tvalue_batch() and secular_batch(). For a single row, as when applying a
+# submission, NumPy's per-call overhead outweighs the work, so PentanomialSPRT()
+# keeps to plain Python. Scripts/bench_stats.py checks that the two agree.
 
+import functools
 import math
+import numpy as np
 import scipy.stats
+import threading
+
+from collections import OrderedDict
 from scipy import optimize
 
+WARM_START_LIMIT = 1024 # Keys for which PentanomialSPRT() remembers its solutions
+WARM_START_CACHE = OrderedDict()
+WARM_START_LOCK  = threading.Lock()
+
+PENTANOMIAL_SCORES = np.array([0.00, 0.25, 0.50, 0.75, 1.00]) # Ptnml(0-2) expressed as (0-1)
+
+T_QUANTILE_EXACT = 1000 # Degrees of freedom beyond which student_t_ppf() is approximated
+
 def TrinomialSPRT(results, elo0, elo1):
 
     # Needs at least 1 Loss, 1 Draw, and 1 Win
@@ -49,7 +72,7 @@ def TrinomialSPRT(results, elo0, elo1):
     # Log-Likelyhood Ratio
     return sum([results[i] * math.log(pdf1[i] / pdf0[i]) for i in range(3)])
 
-def PentanomialSPRT(results, elo0, elo1):
+def PentanomialSPRT(results, elo0, elo1, key=None):
 
     ## Implements https://hardy.uhasselt.be/Fishtest/normalized_elo_practical.pdf
 
@@ -65,12 +88,60 @@ def PentanomialSPRT(results, elo0, elo1):
     N = sum(results)
     pdf = [(i / 4, results[i] / N) for i in range(0, 5)]
 
+    # Previous solutions for this key, if the bounds have not since changed
+    warm = warm_start_lookup(key, elo0, elo1)
+
     # Pdf given each normalized t-value, and then the LLR process for each
-    pdf0, pdf1 = (MLE_tvalue(pdf, 0.5, t) for t in (t0, t1))
+    (pdf0, x0), (pdf1, x1) = (MLE_tvalue(pdf, 0.5, t, *w) for t, w in zip((t0, t1), warm))
     mle_pdf    = [(math.log(pdf1[i][1]) - math.log(pdf0[i][1]), pdf[i][1]) for i in range(len(pdf))]
 
+    warm_start_store(key, elo0, elo1, ((pdf0, x0), (pdf1, x1)))
+
     return N * stats(mle_pdf)[0]
 
+def PentanomialSPRTBatch(results, elo0, elo1):
+
+    ## As PentanomialSPRT(), for each row of results, with its own bounds or shared bounds
+
+    # Ensure no division by 0 issues
+    results = np.maximum(1e-3, np.asarray(results, dtype=float).reshape(-1, 5))
+    elo0    = np.broadcast_to(np.asarray(elo0, dtype=float), len(results))
+    elo1    = np.broadcast_to(np.asarray(elo1, dtype=float), len(results))
+
+    # Partial computation of Normalized t-value
+    nelo_divided_by_nt = 800 / math.log(10)
+    nt0, nt1 = (x / nelo_divided_by_nt for x in (elo0, elo1))
+    t0, t1 = nt0 * math.sqrt(2), nt1 * math.sqrt(2)
+
+    # Number of game-pairs, and the PDF of Ptnml(0-2) expressed as (0-1)
+    N   = results.sum(axis=1)
+    pdf = results / N[:, None]
+
+    # Pdf given each normalized t-value, and then the LLR process for each
+    (pdf0, x0), (pdf1, x1) = (MLE_tvalue_batch(pdf, 0.5, t) for t in (t0, t1))
+
+    return N * (pdf * (np.log(pdf1) - np.log(pdf0))).sum(axis=1)
+
+def warm_start_lookup(key, elo0, elo1):
+
+    with WARM_START_LOCK:
+        if key is not None and (entry := WARM_START_CACHE.get(key)) and entry[0] == (elo0, elo1):
+            WARM_START_CACHE.move_to_end(key)
+            return entry[1]
+
+    return ((None, None), (None, None))
+
+def warm_start_store(key, elo0, elo1, solutions):
+
+    if key is None:
+        return
+
+    with WARM_START_LOCK:
+        WARM_START_CACHE[key] = ((elo0, elo1), solutions)
+        WARM_START_CACHE.move_to_end(key)
+        while len(WARM_START_CACHE) > WARM_START_LIMIT:
+            WARM_START_CACHE.popitem(last=False)
+
 def Elo(results):
 
     # Cannot compute elo without any games
@@ -82,11 +153,34 @@ def Elo(results):
     var = sum(((f / div) - mu)**2 * results[f] for f in range(len(results))) / N
     df  = N - 1 # Degrees of freedom
 
-    mu_min = mu + scipy.stats.t.ppf(0.025, df) * math.sqrt(var) / math.sqrt(N)
-    mu_max = mu + scipy.stats.t.ppf(0.975, df) * math.sqrt(var) / math.sqrt(N)
+    mu_min = mu + student_t_ppf(0.025, df) * math.sqrt(var) / math.sqrt(N)
+    mu_max = mu + student_t_ppf(0.975, df) * math.sqrt(var) / math.sqrt(N)
 
     return logistic_elo(mu_min), logistic_elo(mu), logistic_elo(mu_max)
 
+def student_t_ppf(q, df):
+
+    # scipy.stats.t.ppf() is slow to call, and Elo() is called for every Test that
+    # is rendered. Small degrees of freedom are looked up in a table, built as needed.
+    # Beyond T_QUANTILE_EXACT, the Cornish-Fisher expansion about the Normal quantile
+    # is used, which is accurate to well under 1e-9 at those degrees of freedom
+
+    if df <= T_QUANTILE_EXACT:
+        return student_t_ppf_exact(q, df)
+
+    z = normal_ppf(q)
+    return (z + (z**3 + z) / (4 * df)
+              + (5 * z**5 + 16 * z**3 + 3 * z) / (96 * df**2)
+              + (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / (384 * df**3))
+
+@functools.lru_cache(maxsize=None)
+def student_t_ppf_exact(q, df):
+    return float(scipy.stats.t.ppf(q, df))
+
+@functools.lru_cache(maxsize=None)
+def normal_ppf(q):
+    return float(scipy.stats.norm.ppf(q))
+
 
 def bayeselo_to_proba(elo, draw_elo):
     pwin  = 1.0 / (1.0 + math.pow(10.0, (-elo + draw_elo) / 400.0))
@@ -100,9 +194,10 @@ def proba_to_bayeselo(ploss, pdraw, pwin):
     return (elo, draw_elo)
 
 
-def secular(pdf):
+def secular(pdf, guess=None):
     """
     Solves the secular equation sum_i pi*ai/(1+x*ai)=0.
+    A guess near the root narrows the bracket, if it still contains the root.
     """
     epsilon = 1e-9
     v, w = pdf[0][0], pdf[-1][0]
@@ -116,8 +211,17 @@ def secular(pdf):
     def f(x):
         return sum([pi * ai / (1 + x * ai) for ai, pi in pdf])
 
+    lower, upper = l + epsilon, u - epsilon
+
+    # f() is decreasing, so the root is bracketed iff f(lower) >= 0 >= f(upper)
+    if guess is not None and lower < guess < upper:
+        width = 1e-3 * (upper - lower)
+        a, b  = max(lower, guess - width), min(upper, guess + width)
+        if f(a) >= 0 >= f(b):
+            lower, upper = a, b
+
     x, res = optimize.brentq(
-        f, l + epsilon, u - epsilon, full_output=True, disp=False
+        f, lower, upper, full_output=True, disp=False
     )
     assert res.converged
     return x
@@ -136,10 +240,13 @@ def uniform(pdf):
     n = len(pdf)
     return [(ai, 1 / n) for ai, pi in pdf]
 
-def MLE_tvalue(pdfhat, ref, s):
+def MLE_tvalue(pdfhat, ref, s, start=None, x=None):
+
+    # Returns the MLE pdf, and the final root of the secular equation. Both may
+    # be passed back in as start and x, to warm-start a later, similar, solve
 
     N = len(pdfhat)
-    pdf_MLE = uniform(pdfhat)
+    pdf_MLE = start or uniform(pdfhat)
     for i in range(10):
         pdf_ = pdf_MLE
         mu, var = stats(pdf_MLE)
@@ -148,14 +255,83 @@ def MLE_tvalue(pdfhat, ref, s):
             (ai - ref - s * sigma * (1 + ((mu - ai) / sigma) ** 2) / 2, pi)
             for ai, pi in pdfhat
         ]
-        x = secular(pdf1)
+        x = secular(pdf1, x)
         pdf_MLE = [
             (pdfhat[i][0], pdfhat[i][1] / (1 + x * pdf1[i][0])) for i in range(N)
         ]
         if max([abs(pdf_[i][1] - pdf_MLE[i][1]) for i in range(N)]) < 1e-9:
             break
 
-    return pdf_MLE
+    return pdf_MLE, x
+
+
+def secular_batch(pdf, values, guess=None):
+    """
+    Solves the secular equation sum_i pi*ai/(1+x*ai)=0, for each row of pdf and values.
+    Newton's method is applied within a bracket of the root, bisecting the bracket
+    whenever a step would leave it. Guesses near the roots are used as the start.
+    """
+    epsilon = 1e-9
+    lower   = -1 / values.max(axis=1) + epsilon
+    upper   = -1 / values.min(axis=1) - epsilon
+    assert np.all(values.min(axis=1) * values.max(axis=1) < 0)
+
+    x = (lower + upper) / 2
+    if guess is not None:
+        x = np.where((lower < guess) & (guess < upper), guess, x)
+
+    for i in range(100):
+
+        denom = 1 + x[:, None] * values
+        f     =  (pdf * values / denom).sum(axis=1)
+        df    = -(pdf * values ** 2 / denom ** 2).sum(axis=1)
+
+        # f() is decreasing, so the root is above x iff f(x) > 0
+        lower = np.where(f > 0, x, lower)
+        upper = np.where(f > 0, upper, x)
+
+        step = x - f / df
+        step = np.where((lower <= step) & (step <= upper), step, (lower + upper) / 2)
+
+        done = np.all(np.abs(step - x) <= 1e-15 * np.maximum(1, np.abs(x)))
+        x    = step
+
+        if done:
+            break
+
+    return x
+
+def MLE_tvalue_batch(pdfhat, ref, s, start=None, x=None):
+
+    # As MLE_tvalue(), for each row of pdfhat over PENTANOMIAL_SCORES, with its own s.
+    # Rows stop being updated once converged, as each would in MLE_tvalue(). Returns
+    # the MLE pdfs, and the final roots of the secular equation
+
+    ai      = PENTANOMIAL_SCORES
+    s       = np.broadcast_to(np.asarray(s, dtype=float), len(pdfhat))
+    pdf_MLE = np.full(pdfhat.shape, 1 / len(ai)) if start is None else np.array(start, dtype=float)
+    active  = np.ones(len(pdfhat), dtype=bool)
+
+    for i in range(10):
+
+        mu    = (pdf_MLE * ai).sum(axis=1)
+        var   = (pdf_MLE * (ai - mu[:, None]) ** 2).sum(axis=1)
+        sigma = var ** (1 / 2)
+
+        pdf1  = ai - ref - (s * sigma)[:, None] * (1 + ((mu[:, None] - ai) / sigma[:, None]) ** 2) / 2
+        root  = secular_batch(pdfhat, pdf1, x)
+        pdf_  = pdfhat / (1 + root[:, None] * pdf1)
+
+        # Only rows which had not yet converged are updated
+        delta   = np.abs(pdf_ - pdf_MLE).max(axis=1)
+        pdf_MLE = np.where(active[:, None], pdf_, pdf_MLE)
+        x       = root if x is None else np.where(active, root, x)
+        active &= delta >= 1e-9
+
+        if not active.any():
+            break
+
+    return pdf_MLE, x
 
 
 def logistic_elo(x):
@@ -68,7 +68,7 @@ def shortStatBlock(test):
     if test.test_mode == 'SPSA':
         spsa_run = test.spsa_run # Avoid extra database accesses
         statlines = [
-            'Tuning %d Parameters' % (spsa_run.parameters.count()),
+            'Tuning %d Parameters' % (len(spsa_run.names)),
             '%d/%d Iterations' % (test.games / (2 * spsa_run.pairs_per), spsa_run.iterations),
             '%d/%d Games Played' % (test.games, 2 * spsa_run.iterations * spsa_run.pairs_per)]
 
@@ -88,8 +88,26 @@ def shortStatBlock(test):
         elo_line = 'Elo: %0.2f +- %0.2f (95%%) [N=%d]' % (elo, max(upper - elo, elo - lower), test.max_games)
         statlines = [status_line, elo_line, penta_line] if test.use_penta else [status_line, elo_line, tri_line]
 
+    # Active tests on the index may have an estimated time to completion
+    if getattr(test, 'eta', None) is not None:
+        statlines.append('ETA: %s' % (prettyDuration(test.eta)))
+
     return '\n'.join(statlines)
 
+def prettyDuration(seconds):
+
+    minutes = int(seconds // 60)
+    if minutes < 1:
+        return '< 1m'
+
+    if minutes < 60:
+        return '%dm' % (minutes)
+
+    if minutes < 60 * 24:
+        return '%dh %dm' % (minutes // 60, minutes % 60)
+
+    return '%dd %dh' % (minutes // (60 * 24), (minutes // 60) % 24)
+
 def longStatBlock(test):
 
     assert test.test_mode != 'SPSA'
@@ -209,6 +227,7 @@ register.filter('oneDigitPrecision', oneDigitPrecision)
 register.filter('twoDigitPrecision', twoDigitPrecision)
 register.filter('gitDiffLink', gitDiffLink)
 register.filter('shortStatBlock', shortStatBlock)
+register.filter('prettyDuration', prettyDuration)
 register.filter('longStatBlock', longStatBlock)
 register.filter('testResultColour', testResultColour)
 register.filter('sumAttributes', sumAttributes)
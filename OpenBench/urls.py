@@ -69,6 +69,7 @@ urlpatterns = [
     django.urls.path(r'clientSubmitError/', OpenBench.views.client_submit_error),
     django.urls.path(r'clientSubmitResults/', OpenBench.views.client_submit_results),
     django.urls.path(r'clientHeartbeat/', OpenBench.views.client_heartbeat),
+    django.urls.path(r'clientSubmitBatch/', OpenBench.views.client_submit_batch),
     django.urls.path(r'clientSubmitPGN/', OpenBench.views.client_submit_pgn),
 
     # Nice endpoints, which can be hit from the website or with credentials cleanly
@@ -31,7 +31,8 @@ from django.contrib.auth import authenticate
 from django.core.files.base import ContentFile
 from django.core.files.storage import FileSystemStorage
 from django.db import transaction
-from django.db.models import F
+from django.db.models import Count, F, FloatField, Sum
+from django.db.models.functions import Greatest
 from django.http import FileResponse
 from django.utils import timezone
 from wsgiref.util import FileWrapper
@@ -45,6 +46,8 @@ from OpenBench.stats import TrinomialSPRT, PentanomialSPRT
 
 import OpenBench.views
 import OpenBench.model_utils
+import OpenBench.scheduler
+import OpenBench.spsa_utils
 
 
 class TimeControl(object):
@@ -134,6 +137,111 @@ def workload_uses_time_based_tc(workload):
        or (dev_type  != TimeControl.FIXED_NODES and dev_type  != TimeControl.FIXED_DEPTH) \
        or (base_type != TimeControl.FIXED_NODES and base_type != TimeControl.FIXED_DEPTH)
 
+def set_workload_requirements(workload):
+
+    # Derive the columns used when filtering workloads for a Machine
+
+    workload.dev_threads   = extract_option_int(workload.dev_options,  'Threads', 1)
+    workload.base_threads  = extract_option_int(workload.base_options, 'Threads', 1)
+    workload.max_threads   = max(workload.dev_threads, workload.base_threads)
+
+    workload.hash_mb       = extract_option_int(workload.dev_options,  'Hash', 0) \
+                           + extract_option_int(workload.base_options, 'Hash', 0)
+
+    workload.time_based    = workload_uses_time_based_tc(workload)
+
+    workload.syzygy_pieces = max(
+        [int(x.split('-')[0]) for x in (workload.syzygy_wdl, workload.syzygy_adj) if x.endswith('-MAN')], default=0)
+
+GAME_LENGTH = 70 # Rough number of moves made by each side, when estimating durations
+
+def estimate_game_seconds(test, speed):
+
+    # Requires the Machine's speed, relative to the engines' reference speed
+    if not speed or not test.scale_nps:
+        return None
+
+    dev_seconds  = estimate_side_seconds(test.dev_time_control , test.dev_threads , speed, test.scale_nps)
+    base_seconds = estimate_side_seconds(test.base_time_control, test.base_threads, speed, test.scale_nps)
+
+    if dev_seconds is None or base_seconds is None:
+        return None
+
+    return dev_seconds + base_seconds
+
+def estimate_side_seconds(time_control, threads, speed, scale_nps):
+
+    # Time spent by one side over a game of GAME_LENGTH moves. Fixed-nodes searches are not scaled
+    # by the Client, while times are scaled by the inverse of the speed, so both slow down in kind
+
+    control_type = TimeControl.control_type(time_control)
+
+    if control_type == TimeControl.FIXED_DEPTH:
+        return None
+
+    if control_type == TimeControl.FIXED_NODES:
+        return GAME_LENGTH * TimeControl.control_base(time_control) / (speed * scale_nps * threads)
+
+    if control_type == TimeControl.FIXED_TIME:
+        return GAME_LENGTH * TimeControl.control_base(time_control) / 1000 / speed
+
+    increment = float(time_control.split('+')[1]) if '+' in time_control else 0.0
+
+    if control_type == TimeControl.CYCLIC:
+        moves = int(time_control.split('/')[0])
+        base  = float(time_control.split('/')[1].split('+')[0])
+        return (base * GAME_LENGTH / moves + increment * GAME_LENGTH) / speed
+
+    return (TimeControl.control_base(time_control) + increment * GAME_LENGTH) / speed
+
+def expected_remaining_games(test):
+
+    # Games until a fixed-length test ends, or until an SPRT crosses a bound, were
+    # the LLR to keep drifting at its average rate so far. None when unknown
+
+    if test.test_mode in ('GAMES', 'DATAGEN'):
+        return max(0, test.max_games - test.games)
+
+    if test.test_mode == 'SPSA':
+        return max(0, 2 * test.spsa_run.pairs_per * test.spsa_run.iterations - test.games)
+
+    if not test.games or not test.currentllr:
+        return None
+
+    drift = test.currentllr / test.games
+    bound = test.upperllr if drift > 0 else test.lowerllr
+    return max(0, int((bound - test.currentllr) / drift))
+
+def estimate_completion_times(tests):
+
+    # Attach .eta, the seconds until each test is expected to end, given the games
+    # per second being played by the Machines currently assigned to each test
+
+    rates = {}
+    for assignment in getRecentAssignments().filter(test_id__in=[x.id for x in tests]):
+        rates.setdefault(assignment.test_id, []).append(assignment)
+
+    for test in tests:
+
+        test.eta = None
+        if (remaining := expected_remaining_games(test)) is None:
+            continue
+
+        rate = 0.00
+        for assignment in rates.get(test.id, []):
+
+            # Machines yet to report their speed are counted as running at the reference speed
+            speed = assignment.mnps * 1e6 / test.scale_nps if assignment.mnps and test.scale_nps else 1.00
+            slots = max(1, assignment.threads // test.max_threads)
+
+            if not (seconds := estimate_game_seconds(test, speed)):
+                break
+
+            rate += slots / seconds
+
+        else:
+            if rate:
+                test.eta = remaining / rate
 
 
 def path_join(*args):
@@ -159,6 +267,12 @@ def extract_option(options, option):
     match = re.search(r'(?<={0}=)[^ ]*'.format(option), options)
     if match: return match.group()
 
+def extract_option_int(options, option, default):
+
+    # Very old Tests might not have parsable values
+    try: return int(extract_option(options, option))
+    except (TypeError, ValueError): return default
+
 
 
 
@@ -194,16 +308,28 @@ def getRecentMachines(minutes=2):
     target = target - datetime.timedelta(minutes=minutes)
     return Machine.objects.filter(updated__gte=target)
 
+def getRecentAssignments(minutes=2):
+    target = datetime.datetime.utcnow()
+    target = target.replace(tzinfo=timezone.utc)
+    target = target - datetime.timedelta(minutes=minutes)
+    return ActiveAssignment.objects.filter(last_seen__gte=target)
+
 def getMachineStatus(username=None):
 
-    machines = getRecentMachines()
+    assignments = getRecentAssignments()
 
     if username != None:
-        machines = machines.filter(user__username=username)
+        assignments = assignments.filter(user__username=username)
 
-    return ": {0} Machines / ".format(len(machines)) + \
-           "{0} Threads / ".format(sum([f.info['concurrency'] for f in machines])) + \
-           "{0} MNPS ".format(round(sum([f.info['concurrency'] * f.mnps for f in machines]), 2))
+    status = assignments.aggregate(
+        machines = Count('machine_id'),
+        threads  = Sum('threads'),
+        mnps     = Sum(F('threads') * F('mnps'), output_field=FloatField()),
+    )
+
+    return ": {0} Machines / ".format(status['machines']) + \
+           "{0} Threads / ".format(status['threads'] or 0) + \
+           "{0} MNPS ".format(round(status['mnps'] or 0, 2))
 
 def getPaging(content, page, url, pagelen=25):
 
@@ -357,64 +483,191 @@ def network_edit(request, engine, network):
     return OpenBench.views.redirect(request, '/networks/%s' % (network.engine), status='Applied changes')
 
 
-def update_test(request, machine):
+def follow_workload_bundle(machine, test_id):
 
-    # Extract error information
-    crashes    = int(request.POST['crashes'   ])
-    timelosses = int(request.POST['timelosses'])
-    illegals   = int(request.POST['illegals'  ])
+    # Reassign the Machine to the next workload of its bundle, once it begins playing it.
+    # Only move forward, as leftover results for earlier workloads may still arrive.
+    # The first workload is not in the bundle, and so comes before all of it
+
+    bundle  = machine.info.get('bundle', [])
+    current = bundle.index(machine.workload) if machine.workload in bundle else -1
+
+    if test_id in bundle and bundle.index(test_id) > current:
+        machine.workload = test_id
+        Machine.objects.filter(id=machine.id).update(workload=test_id)
+
+def parse_result_delta(data, machine):
+
+    # Results are POSTed by the Client, either alone or as one of a batch
 
     # Extract Database information
-    machine_id = int(request.POST['machine_id'])
-    result_id  = int(request.POST['result_id' ])
-    test_id    = int(request.POST['test_id'   ])
+    delta = {
+        'machine_id' : machine.id,
+        'user_id'    : machine.user_id,
+        'result_id'  : int(data['result_id']),
+        'test_id'    : int(data['test_id'  ]),
+        'sequence'   : int(data.get('sequence', 0)),
+    }
+
+    # Extract error information
+    delta['crashes'   ] = int(data['crashes'   ])
+    delta['timelosses'] = int(data['timelosses'])
+    delta['illegals'  ] = int(data['illegals'  ])
 
     # Trinomial Implementation
-    losses, draws, wins = map(int, request.POST['trinomial'].split())
-    games = losses + draws + wins
+    delta['losses'], delta['draws'], delta['wins'] = map(int, data['trinomial'].split())
+    delta['games'] = delta['losses'] + delta['draws'] + delta['wins']
 
     # Pentanomial Implementation
-    LL, LD, DD, DW, WW = map(int, request.POST['pentanomial'].split())
+    delta['LL'], delta['LD'], delta['DD'], delta['DW'], delta['WW'] = map(int, data['pentanomial'].split())
 
     # SPSA Delta update vector; might not have this
-    raw_spsa_delta = request.POST.get('spsa_delta', '')
-    spsa_delta     = json.loads(raw_spsa_delta) if raw_spsa_delta else []
+    raw_spsa_delta      = data.get('spsa_delta', '')
+    delta['spsa_delta'] = json.loads(raw_spsa_delta) if raw_spsa_delta else []
+
+    return delta
+
+def update_test(data, machine):
+
+    delta = parse_result_delta(data, machine)
+
+    # Machines playing a bundle of workloads move through each in turn
+    follow_workload_bundle(machine, delta['test_id'])
+
+    test = apply_result_deltas(delta['test_id'], [delta])
+
+    # Keep the Scheduler's view of the Machine current
+    OpenBench.scheduler.machine_seen(machine)
+
+    return [{}, { 'stop' : True }][not test or test.finished or test.deleted]
+
+def journal_results(data, machine):
+
+    # With aggregate_results, results are only recorded in the ResultJournal, and
+    # acknowledged immediately. The ResultFlusher later applies them in bulk
+
+    delta = parse_result_delta(data, machine)
+
+    # Machines playing a bundle of workloads move through each in turn
+    follow_workload_bundle(machine, delta['test_id'])
+
+    # Results for a finished, deleted, or unknown test are dropped
+    test = Test.objects.only('finished', 'deleted').filter(id=delta['test_id']).first()
+    if not test or test.finished or test.deleted:
+        return { 'stop' : True }
+
+    # Results for an unknown Result, or for one of another test or user, are dropped.
+    # Those would otherwise fail when applied by the ResultFlusher, every time
+    if not Result.objects.filter(id=delta['result_id'], test_id=test.id, user_id=machine.user_id).exists():
+        return {}
+
+    ResultJournal.objects.create(test_id=delta['test_id'], delta=delta)
+
+    # Keep the Scheduler's view of the Machine current
+    OpenBench.scheduler.machine_seen(machine)
+
+    return {}
+
+def sum_result_deltas(deltas):
+
+    counters = ['losses', 'draws', 'wins', 'LL', 'LD', 'DD', 'DW', 'WW', 'games', 'crashes', 'timelosses', 'illegals']
+    totals   = { field : sum(x[field] for x in deltas) for field in counters }
+
+    # Sequence numbers are not summed, only the latest is kept
+    totals['sequence'] = max(x.get('sequence', 0) for x in deltas)
+
+    return totals
+
+def group_result_deltas(deltas, key):
+
+    groups = {}
+    for delta in deltas:
+        groups.setdefault(delta[key], []).append(delta)
+
+    return { value : sum_result_deltas(group) for value, group in groups.items() }
+
+def drop_applied_deltas(deltas):
+
+    # Clients number each submission, so that one resent after a timeout, or replayed
+    # after a crash, is applied only once. Unnumbered submissions are always applied.
+    #
+    # Submissions for an unknown Result, or for a Result of another Test or of another
+    # user, can never be applied. Those are dropped too, and so acknowledged, rather than
+    # failing, since a Client would otherwise resend them with every report that follows
+
+    result_ids = { x['result_id'] for x in deltas }
+    results    = Result.objects.filter(id__in=result_ids).values_list('id', 'test_id', 'user_id', 'sequence')
+    owners     = { result_id : (test_id, user_id) for result_id, test_id, user_id, sequence in results }
+    latest     = { result_id : sequence for result_id, test_id, user_id, sequence in results }
+    fresh      = []
+
+    for delta in deltas:
+
+        if owners.get(delta['result_id']) != (delta['test_id'], delta['user_id']):
+            continue
+
+        sequence = delta.get('sequence', 0)
+        if sequence and sequence <= latest[delta['result_id']]:
+            continue
+
+        latest[delta['result_id']] = max(sequence, latest[delta['result_id']])
+        fresh.append(delta)
+
+    return fresh
+
+def apply_result_deltas(test_id, deltas):
 
     with transaction.atomic():
 
         # MASSIVE risk for concurrent access to the Test. select_for_update() will lock the row,
-        # which correctly ensures no other entity can modify it. HOWEVER, spsa_run and the various
-        # spsa_run.parameters are NOT locked via this query. This is okay because no other location
-        # in OpenBench would be modifying the contents of those models.
+        # which correctly ensures no other entity can modify it. HOWEVER, the spsa_run is NOT locked
+        # via this query. This is okay because spsa_run.values, its only mutable state, is written
+        # solely by spsa_flush_deltas(), while holding this lock. Every read-modify-write of the
+        # values for a tune is therefore serialized by the lock on its Test. Elsewhere, the values
+        # are only read, when assigning or viewing the tune, which never needs the lock.
         #
-        # ALL of the updates here, even the trivial ones to the Profile and Machine, are wrapped in
-        # same transaction.atomic(). The sole purpose and utility of that is to ensure either EVERYTHING
-        # gets updated as per this function, or NOTHING gets updated.
+        # The updates to the Test and its Results are wrapped in the same transaction.atomic(). The
+        # sole purpose and utility of that is to ensure either ALL of them get updated as per this
+        # function, or NONE of them get updated. Only the Test and Result rows are locked here.
+
+        test = Test.objects.select_for_update().filter(id=test_id).first()
 
-        test = Test.objects.select_for_update().get(id=test_id)
+        # Results for an unknown Test are dropped, as for a finished one
+        if not test:
+            OpenBench.scheduler.SNAPSHOT.discard_test(test_id)
+            return None
 
         if test.finished or test.deleted:
-            return { 'stop' : True }
-
-        test.losses += losses # Trinomial
-        test.draws  += draws
-        test.wins   += wins
-        test.LL     += LL     # Pentanomial
-        test.LD     += LD
-        test.DD     += DD
-        test.DW     += DW
-        test.WW     += WW
-        test.games  += games  # Overall
+            OpenBench.scheduler.SNAPSHOT.discard_test(test.id)
+            OpenBench.spsa_utils.spsa_flush_deltas(test.id, force=True) # Tunes stopped by hand
+            return test
+
+        # Sequence numbers are only read while holding the lock on the Test
+        if not (deltas := drop_applied_deltas(deltas)):
+            return test
+
+        # Sum every delta to the Test, as if it were a single submission
+        totals = sum_result_deltas(deltas)
+
+        test.losses += totals['losses'] # Trinomial
+        test.draws  += totals['draws' ]
+        test.wins   += totals['wins'  ]
+        test.LL     += totals['LL'    ] # Pentanomial
+        test.LD     += totals['LD'    ]
+        test.DD     += totals['DD'    ]
+        test.DW     += totals['DW'    ]
+        test.WW     += totals['WW'    ]
+        test.games  += totals['games' ] # Overall
 
         # Consider only Crashes or Illegal moves as real errors
-        test.error = bool(test.error or crashes or illegals)
+        test.error = bool(test.error or totals['crashes'] or totals['illegals'])
 
         if test.test_mode == 'SPRT':
 
             # Compute a new LLR for the updated results ( Penta )
             if test.use_penta:
                 results = (test.LL, test.LD, test.DD, test.DW, test.WW)
-                test.currentllr = PentanomialSPRT(results, test.elolower, test.eloupper)
+                test.currentllr = PentanomialSPRT(results, test.elolower, test.eloupper, key=test.id)
 
             # Compute a new LLR for the updated results ( Tri )
             elif test.use_tri:
@@ -435,16 +688,12 @@ def update_test(request, machine):
 
         elif test.test_mode == 'SPSA':
 
-            # Apply updates to every Parameter, ensuring clipping
-            parameters = list(test.spsa_run.parameters.order_by('index'))
-            for delta, param in zip(spsa_delta, parameters):
-                param.value = max(param.min_value, min(param.max_value, param.value + delta))
-
-            # Bulk update to fire off all the .save()s
-            SPSAParameter.objects.bulk_update(parameters, ['value'])
-
             test.finished = test.games >= 2 * test.spsa_run.pairs_per * test.spsa_run.iterations
 
+            # Apply updates to the packed vector of every Parameter, ensuring clipping
+            spsa_deltas = [x['spsa_delta'] for x in deltas]
+            OpenBench.spsa_utils.spsa_apply_deltas(test.spsa_run, spsa_deltas, test.finished)
+
         elif test.test_mode == 'DATAGEN':
 
             # Finished, and always passing, for a completed DATAGEN Workload
@@ -452,31 +701,83 @@ def update_test(request, machine):
 
         test.save()
 
-        # Update Result object; No risk from concurrent access
-        Result.objects.filter(id=result_id).update(
-            games    = F('games'   ) + games,
-            losses   = F('losses'  ) + losses,
-            draws    = F('draws'   ) + draws,
-            wins     = F('wins'    ) + wins,
-            LL       = F('LL'      ) + LL,
-            LD       = F('LD'      ) + LD,
-            DD       = F('DD'      ) + DD,
-            DW       = F('DW'      ) + DW,
-            WW       = F('WW'      ) + WW,
-            crashes  = F('crashes' ) + crashes,
-            timeloss = F('timeloss') + timelosses,
-            updated  = timezone.now()
-        )
-
-        # Update Profile object; Some risk from concurrent access
-        Profile.objects.filter(user=Machine.objects.select_for_update().get(id=machine_id).user).update(
-            games=F('games') + games,
+        # Extend the Test's history, for graphing its progress over time
+        record_progress(test)
+
+        # Update Result objects; No risk from concurrent access
+        for result_id, delta in group_result_deltas(deltas, 'result_id').items():
+            Result.objects.filter(id=result_id).update(
+                games    = F('games'   ) + delta['games'     ],
+                losses   = F('losses'  ) + delta['losses'    ],
+                draws    = F('draws'   ) + delta['draws'     ],
+                wins     = F('wins'    ) + delta['wins'      ],
+                LL       = F('LL'      ) + delta['LL'        ],
+                LD       = F('LD'      ) + delta['LD'        ],
+                DD       = F('DD'      ) + delta['DD'        ],
+                DW       = F('DW'      ) + delta['DW'        ],
+                WW       = F('WW'      ) + delta['WW'        ],
+                crashes  = F('crashes' ) + delta['crashes'   ],
+                timeloss = F('timeloss') + delta['timelosses'],
+                sequence = Greatest(F('sequence'), delta['sequence']),
+                updated  = timezone.now()
+            )
+
+    # Update Profile objects, once committed; No risk, as F() increments are atomic
+    for user_id, delta in group_result_deltas(deltas, 'user_id').items():
+        Profile.objects.filter(user_id=user_id).update(
+            games=F('games') + delta['games'],
             updated=timezone.now()
         )
 
-        # Update Machine object; No meaningful risk from concurrent access
-        Machine.objects.filter(id=machine_id).update(
-            updated=timezone.now()
-        )
+    # Update Machine objects, once committed; No meaningful risk from concurrent access
+    Machine.objects.filter(id__in=[x['machine_id'] for x in deltas]).update(
+        updated=timezone.now()
+    )
+
+    # Keep the Scheduler's view of a finished Test current
+    if test.finished:
+        OpenBench.scheduler.SNAPSHOT.update_test(test)
+
+    return test
+
+# Maximum age in seconds, and bucket width in seconds, for each resolution of ProgressPoints
+PROGRESS_TIERS = [ (3600, 60), (86400, 600), (604800, 3600), (None, 21600) ]
+
+def record_progress(test):
+
+    # Snapshot the Test's totals, at most once per bucket of the finest PROGRESS_TIERS,
+    # and always when the Test finishes. The Test's lock serializes this per Test
+
+    now    = timezone.now()
+    latest = ProgressPoint.objects.filter(test_id=test.id).order_by('-timestamp').first()
+
+    if not test.finished and latest and (now - latest.timestamp).total_seconds() < PROGRESS_TIERS[0][1]:
+        return
+
+    ProgressPoint.objects.create(
+        test_id=test.id, timestamp=now, games=test.games, llr=test.currentllr,
+        LL=test.LL, LD=test.LD, DD=test.DD, DW=test.DW, WW=test.WW,
+    )
+
+    compact_progress(test.id, now)
+
+def compact_progress(test_id, now):
+
+    # Older snapshots are kept at coarser resolutions. As totals only ever grow, the
+    # latest snapshot within each bucket is the only one which needs to be kept
+
+    points = ProgressPoint.objects.filter(test_id=test_id).order_by('-timestamp')
+    seen, expired = set(), []
+
+    for point_id, timestamp in points.values_list('id', 'timestamp'):
+
+        age    = (now - timestamp).total_seconds()
+        width  = next(width for limit, width in PROGRESS_TIERS if limit is None or age < limit)
+        bucket = (width, int(timestamp.timestamp() // width))
+
+        if bucket in seen:
+            expired.append(point_id)
+        seen.add(bucket)
 
-    return [{}, { 'stop' : True }][test.finished]
+    if expired:
+        ProgressPoint.objects.filter(id__in=expired).delete()
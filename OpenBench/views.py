@@ -18,7 +18,7 @@
 #                                                                             #
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
-import csv, io, os, json, secrets
+import csv, io, os, json, secrets, traceback
 
 import django.http
 import django.shortcuts
@@ -26,14 +26,15 @@ import django.contrib.auth
 
 import OpenBench.config
 import OpenBench.model_utils
+import OpenBench.scheduler
 import OpenBench.spsa_utils
 import OpenBench.utils
 
 from OpenBench.workloads.create_workload import create_workload
-from OpenBench.workloads.get_workload import get_workload
+from OpenBench.workloads.get_workload import get_workload, prefetch_workload
 from OpenBench.workloads.modify_workload import modify_workload
 from OpenBench.workloads.verify_workload import verify_workload
-from OpenBench.workloads.view_workload import view_workload, fetch_results, fetch_result_summaries
+from OpenBench.workloads.view_workload import view_workload, fetch_results, fetch_result_summaries, fetch_progress_history
 
 from OpenBench.config import OPENBENCH_CONFIG, OPENBENCH_CONFIG_CHECKSUM, OPENBENCH_STATIC_VERSION
 from OpenSite.settings import PROJECT_PATH
@@ -42,7 +43,7 @@ from OpenBench.models import *
 from django.contrib.auth.models import User
 from OpenSite.settings import MEDIA_ROOT
 
-from django.db import transaction
+from django.db import transaction, OperationalError
 from django.db.models import F, Q
 from django.http import HttpResponse, JsonResponse, FileResponse
 from django.views.decorators.csrf import csrf_exempt
@@ -271,6 +272,10 @@ def index(request, page=1):
 
     start, end, paging = OpenBench.utils.getPaging(completed, int(page), 'index')
 
+    # Estimate how long each active test has left, given the Machines now playing it
+    active = list(active)
+    OpenBench.utils.estimate_completion_times(active)
+
     data = {
         'pending'   : pending,
         'active'    : OpenBench.utils.group_active_tests_by_priority(active),
@@ -289,6 +294,10 @@ def user(request, username, page=1):
 
     start, end, paging = OpenBench.utils.getPaging(completed, int(page), 'user/%s' % (username))
 
+    # Estimate how long each active test has left, given the Machines now playing it
+    active = list(active)
+    OpenBench.utils.estimate_completion_times(active)
+
     data = {
         'pending'   : pending,
         'active'    : OpenBench.utils.group_active_tests_by_priority(active),
@@ -706,6 +715,7 @@ def client_worker_info(request):
 
     # Finish up
     machine.save()
+    OpenBench.scheduler.machine_seen(machine)
 
     # Pass back the Machine Id, and Secret Token for this session
     return JsonResponse({ 'machine_id' : machine.id, 'secret' : machine.secret })
@@ -732,6 +742,7 @@ def client_bench_error(request, machine):
     # Find and stop the test with the bad bench
     test = Test.objects.get(id=int(request.POST['test_id']))
     test.finished = True; test.save()
+    OpenBench.scheduler.SNAPSHOT.update_test(test)
 
     # Log the error into the Events table
     LogEvent.objects.create(
@@ -751,7 +762,15 @@ def client_submit_nps(request, machine):
     machine.mnps      = float(request.POST['nps'     ]) / 1e6;
     machine.dev_mnps  = float(request.POST['dev_nps' ]) / 1e6;
     machine.base_mnps = float(request.POST['base_nps']) / 1e6;
+
+    # Bench speeds when using only physical cores, and when using every thread
+    physical_nps = int(request.POST.get('physical_nps', 0))
+    logical_nps  = int(request.POST.get('logical_nps' , 0))
+    if physical_nps and logical_nps:
+        machine.info['smt'] = { 'physical_nps' : physical_nps, 'logical_nps' : logical_nps }
+
     machine.save()
+    OpenBench.scheduler.machine_seen(machine)
 
     # Pass back an empty JSON response
     return JsonResponse({})
@@ -784,18 +803,75 @@ def client_submit_error(request, machine):
 def client_submit_results(request, machine):
 
     # Returns {}, or { 'stop' : True }
-    return JsonResponse(OpenBench.utils.update_test(request, machine))
+    response = submit_results(request.POST, machine)
+
+    # Look ahead to the next workload, if the Client would like to prepare it
+    if 'stop' not in response and (prefetch := prefetch_workload(request, machine)):
+        response['prefetch'] = prefetch
+
+    return JsonResponse(response)
 
 @csrf_exempt
 @verify_worker
 def client_heartbeat(request, machine):
 
-    # Force a refresh of the updated timestamp
+    # Returns {}, or { 'stop' : True }
+    response = submit_heartbeat(request.POST, machine)
+
+    # Look ahead to the next workload, if the Client would like to prepare it
+    if 'stop' not in response and (prefetch := prefetch_workload(request, machine)):
+        response['prefetch'] = prefetch
+
+    return JsonResponse(response)
+
+@csrf_exempt
+@verify_worker
+def client_submit_batch(request, machine):
+
+    # Several results and heartbeats in one request, each formatted as it would be
+    # when POSTed alone. Responses are given per entry, in the same order. An entry
+    # which fails is given an error, and is marked for a retry only if it might pass
+    # later, such as when the database was locked. Anything else, like a malformed
+    # entry, would fail every time, and so the Client is free to discard it
+
+    responses = []
+    for entry in json.loads(request.POST['entries']):
+
+        submit = submit_heartbeat if entry['type'] == 'heartbeat' else submit_results
+
+        try: responses.append(submit(entry, machine))
+        except Exception as error:
+            traceback.print_exc()
+            responses.append({
+                'error' : '%s: %s' % (type(error).__name__, error),
+                'retry' : isinstance(error, OperationalError),
+            })
+
+    response = { 'entries' : responses }
+
+    # Look ahead to the next workload, if the Client would like to prepare it
+    if prefetch := prefetch_workload(request, machine):
+        response['prefetch'] = prefetch
+
+    return JsonResponse(response)
+
+def submit_results(data, machine):
+
+    if OPENBENCH_CONFIG['aggregate_results']:
+        return OpenBench.utils.journal_results(data, machine)
+
+    return OpenBench.utils.update_test(data, machine)
+
+def submit_heartbeat(data, machine):
+
+    # Force a refresh of the updated timestamp, and follow any bundled workloads
+    OpenBench.utils.follow_workload_bundle(machine, int(data['test_id']))
     machine.save()
+    OpenBench.scheduler.machine_seen(machine)
 
     # Include a 'stop' header iff the test was finished
-    test = Test.objects.get(id=int(request.POST['test_id']))
-    return JsonResponse([{}, { 'stop' : True }][test.finished])
+    test = Test.objects.get(id=int(data['test_id']))
+    return { 'stop' : True } if test.finished else {}
 
 @csrf_exempt
 @verify_worker
@@ -963,7 +1039,7 @@ def api_pgns(request, pgn_id):
         return api_response({ 'error' : 'PGNs cannot be downloaded while the Workload is active' })
 
     # 4. Make sure no active workers are still on this workload
-    if OpenBench.utils.getRecentMachines().filter(workload=pgn_id):
+    if OpenBench.utils.getRecentAssignments().filter(test_id=pgn_id).exists():
         return api_response({ 'error' : 'Some machines are still on this Workload. Try again shortly' })
 
     # 5. Make sure there are no pending .pgn.bz2 files to be processed
@@ -1026,7 +1102,10 @@ def api_workload(request, workload_id, query):
     if query == 'summary':
         return api_response({ 'summary' : fetch_result_summaries(workload) })
 
-    valid_endpoints = [ 'results', 'info', 'summary' ]
+    if query == 'history':
+        return JsonResponse({ 'history' : fetch_progress_history(workload) })
+
+    valid_endpoints = [ 'results', 'info', 'summary', 'history' ]
     return api_response({ 'error' : 'Valid /query/ endpoints are: [ %s ]' % (', '.join(valid_endpoints)) })
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -35,6 +35,7 @@ import requests
 
 from django.db import transaction
 
+import OpenBench.scheduler
 import OpenBench.spsa_utils
 import OpenBench.utils
 import OpenBench.views
@@ -103,6 +104,7 @@ def create_workload(request, workload_type):
 
     if not OPENBENCH_CONFIG['use_cross_approval'] and profile.approver:
         workload.approved = True; workload.save()
+        OpenBench.scheduler.SNAPSHOT.update_test(workload)
 
     return OpenBench.views.redirect(request, '/index/', warning=warning)
 
@@ -165,7 +167,11 @@ def create_new_test(request):
     if test.base_network:
         test.base_netname = Network.objects.get(engine=test.base_engine, sha256=test.base_network).name
 
-    test.save()
+    OpenBench.utils.set_workload_requirements(test)
+
+    with transaction.atomic():
+        test.save()
+        BookCursor.objects.create(test=test)
 
     profile = Profile.objects.get(user=request.user)
     profile.tests += 1
@@ -212,8 +218,11 @@ def create_new_tune(request):
         name = Network.objects.get(engine=test.dev_engine, sha256=test.dev_network).name
         test.dev_netname = test.base_netname = name
 
+    OpenBench.utils.set_workload_requirements(test)
+
     with transaction.atomic():
         test.save()
+        BookCursor.objects.create(test=test)
         OpenBench.spsa_utils.create_spsa_run(test, request).save()
 
     profile = Profile.objects.get(user=request.user)
@@ -277,7 +286,11 @@ def create_new_datagen(request):
     if test.base_network:
         test.base_netname = Network.objects.get(engine=test.base_engine, sha256=test.base_network).name
 
-    test.save()
+    OpenBench.utils.set_workload_requirements(test)
+
+    with transaction.atomic():
+        test.save()
+        BookCursor.objects.create(test=test)
 
     profile = Profile.objects.get(user=request.user)
     profile.tests += 1
@@ -25,16 +25,20 @@
 
 import math
 import random
-import re
 import sys
 
+import OpenBench.scheduler
 import OpenBench.utils
 
 from OpenBench.config import OPENBENCH_CONFIG
-from OpenBench.models import Result, Test
+from OpenBench.models import BookCursor, Result, Test
+from OpenBench.scheduler import SNAPSHOT
 from OpenBench.spsa_utils import spsa_workload_assignment_dict
 
 from django.db import transaction
+from django.db.models import F
+
+SPRT_TAIL_FRACTION = 0.50 # Share of the way to a bound an SPRT's LLR must cover, before its workloads shrink
 
 def get_workload(request, machine):
 
@@ -43,24 +47,107 @@ def get_workload(request, machine):
         return {}
 
     # Avoid creating duplicate Result objects
-    result, created = Result.objects.get_or_create(test=test, machine=machine)
+    result, created = Result.objects.get_or_create(test=test, machine=machine, defaults={ 'user_id' : machine.user_id })
+
+    # Short workloads which may be played afterwards, using the same binaries
+    bundle  = select_bundled_workloads(request, machine, test)
+    results = [Result.objects.get_or_create(test=x, machine=machine, defaults={ 'user_id' : machine.user_id })[0] for x in bundle]
+
+    # Remember the Machine's relative speed, as its NPS is about to be cleared
+    if speed := SNAPSHOT.machine_speed(machine):
+        machine.info['speed'] = speed
 
     # Update the Machine's status and save everything
     machine.workload = test.id;
+    machine.info['bundle'] = [x.id for x in bundle]
     machine.mnps = machine.dev_mnps = machine.base_mnps = 0.00
     machine.save(); result.save()
+    OpenBench.scheduler.machine_seen(machine)
+
+    return {
+        'workload' : workload_to_dictionary(test, result, machine),
+        'bundle'   : [workload_to_dictionary(x, y, machine) for x, y in zip(bundle, results)],
+        'prefetch' : prefetch_workload(request, machine),
+    }
+
+def select_bundled_workloads(request, machine, test):
+
+    # Fixed-node and fixed-depth workloads are short enough that the setup, builds, and
+    # benchmarks dominate. Clients may play several back to back, after a single setup,
+    # so long as each uses the same binaries, and is served no better than the one chosen
+
+    size = OPENBENCH_CONFIG['workload_bundle_size']
+    if size <= 1 or not request.POST.get('bundle'):
+        return []
+
+    with SNAPSHOT.lock:
+
+        primary = SNAPSHOT.tests.get(test.id)
+        if not primary or primary['time_based']:
+            return []
+
+        candidates, has_focus = filter_valid_workloads(request, machine)
+        candidates = [x for x in candidates if x['binaries'] == primary['binaries'] and not x['time_based']]
+        if len(candidates) <= 1:
+            return []
+
+        worker_dist, engine_freq = compute_resource_distribution(candidates, machine, has_focus)
+        machine_threads          = SNAPSHOT.machine_weight(machine)
 
-    return { 'workload' : workload_to_dictionary(test, result, machine) }
+    # Same Resource Ratios as in select_workload(), were the Machine assigned to each
+    if OPENBENCH_CONFIG['balance_engine_throughputs']:
+        for id, data in worker_dist.items():
+            data['throughput'] = data['throughput'] / engine_freq[data['engine']]
+
+    for id, data in worker_dist.items():
+        data['ratio'] = (data['threads'] + machine_threads) / data['throughput']
+
+    # Take the least served first, and only those within 25% of the chosen workload
+    target  = 1.25 * worker_dist[test.id]['ratio'] if test.id in worker_dist else 0
+    choices = sorted(worker_dist.keys() - { test.id }, key=lambda x: worker_dist[x]['ratio'])
+    choices = [x for x in choices if worker_dist[x]['ratio'] <= target][:size-1]
+
+    bundle = Test.objects.select_related('dev', 'base').filter(id__in=choices)
+    bundle = [x for x in bundle if OpenBench.scheduler.test_is_active(x)]
+    return sorted(bundle, key=lambda x: choices.index(x.id))
 
-def select_workload(request, machine):
+def prefetch_workload(request, machine):
 
-    # Step 1: Refine active workloads to the candidate assignments
-    candidates, has_focus = filter_valid_workloads(request, machine)
-    if not candidates:
+    # Tentative next assignment, were the current one to end, which Clients can prepare
+    # ahead of time. Nothing is reserved for the Machine, and the actual next assignment
+    # may differ, since it will be decided later using the state of the world at that time
+
+    if not request.POST.get('prefetch'):
+        return None
+
+    if not (test := select_workload(request, machine, exclude=machine.workload)):
         return None
 
-    # Step 2: Count relevant threads on each candidate test
-    worker_dist, engine_freq = compute_resource_distribution(candidates, machine, has_focus)
+    return {
+        'id'   : test.id,
+        'book' : book_to_dictionary(test),
+        'dev'  : engine_to_dictionary(test, 'dev' ),
+        'base' : engine_to_dictionary(test, 'base'),
+    }
+
+def select_workload(request, machine, exclude=None):
+
+    with SNAPSHOT.lock:
+
+        # Step 0: Bring the Scheduler's Snapshot up to date, if needed
+        SNAPSHOT.refresh()
+
+        # Step 1: Refine active workloads to the candidate assignments
+        candidates, has_focus = filter_valid_workloads(request, machine, exclude)
+        if not candidates:
+            return None
+
+        # Step 2: Count relevant threads on each candidate test
+        worker_dist, engine_freq = compute_resource_distribution(candidates, machine, has_focus)
+        machine_threads          = SNAPSHOT.machine_weight(machine)
+
+        # Candidates for which the Machine already has every Binary and Network
+        cached = [x['id'] for x in candidates if workload_is_cached(request, x)]
 
     # Step 3: Determine the effective-throughput for each workload
     if OPENBENCH_CONFIG['balance_engine_throughputs']:
@@ -69,11 +156,11 @@ def select_workload(request, machine):
 
     # Step 4: Compute the Resource Ratios for each of the workloads, if we were assigned
     for id, data in worker_dist.items():
-        data['ratio'] = (data['threads'] + machine.info['concurrency']) / data['throughput']
+        data['ratio'] = (data['threads'] + machine_threads) / data['throughput']
 
     # Step 5: Compute the idealized "Fair-Ratio" once our machine is added
     min_ratio      = min(x['ratio'] for x in worker_dist.values())
-    thread_sum     = sum(x['threads'] for x in worker_dist.values()) + machine.info['concurrency']
+    thread_sum     = sum(x['threads'] for x in worker_dist.values()) + machine_threads
     throughput_sum = sum(x['throughput'] for x in worker_dist.values())
     fair_ratio     = thread_sum / throughput_sum
 
@@ -81,35 +168,54 @@ def select_workload(request, machine):
     if machine.workload in worker_dist.keys():
         this_ratio = worker_dist[machine.workload]['ratio']
         if min_ratio / fair_ratio > 0.75 and this_ratio / fair_ratio < 1.25:
-            return Test.objects.get(id=machine.workload)
+            return fetch_selected_workload(request, machine, exclude, machine.workload)
+
+    # Step 7: Prefer a test needing no builds, if still within +- 25% fairness
+    if cached and min_ratio / fair_ratio > 0.75:
+        cached_ratio = min(worker_dist[x]['ratio'] for x in cached)
+        if cached_ratio / fair_ratio < 1.25:
+            choices = [x for x in cached if worker_dist[x]['ratio'] == cached_ratio]
+            return fetch_selected_workload(request, machine, exclude, random.choice(choices))
 
-    # Step 7: Pick a random test, amongst those who share the min_ratio, weighted by throughput
+    # Step 8: Pick a random test, amongst those who share the min_ratio, weighted by throughput
     choices = [id for id, data in worker_dist.items() if data['ratio'] == min_ratio]
     weights = [data['throughput'] for id, data in worker_dist.items() if data['ratio'] == min_ratio]
-    return Test.objects.get(id=random.choices(choices, weights=weights)[0])
+    return fetch_selected_workload(request, machine, exclude, random.choices(choices, weights=weights)[0])
+
+def fetch_selected_workload(request, machine, exclude, test_id):
 
-def filter_valid_workloads(request, machine):
+    # Another process may have finished or altered the Test since our last rebuild
+    test = Test.objects.select_related('dev', 'base').filter(id=test_id).first()
+    if test and OpenBench.scheduler.test_is_active(test):
+        return test
 
-    workloads = OpenBench.utils.get_active_tests()
+    # Drop the stale entry from the Snapshot, and then try again
+    SNAPSHOT.discard_test(test_id)
+    return select_workload(request, machine, exclude)
+
+def filter_valid_workloads(request, machine, exclude=None):
+
+    workloads = SNAPSHOT.active_tests()
+
+    # Skip the workload being excluded, when looking ahead to the next one
+    if exclude:
+        workloads = [x for x in workloads if x['id'] != exclude]
 
     # Skip engines that the Machine cannot handle
-    for engine in OPENBENCH_CONFIG['engines'].keys():
-        if engine not in machine.info['supported']:
-            workloads = workloads.exclude(dev_engine=engine)
-            workloads = workloads.exclude(base_engine=engine)
+    supported = machine.info['supported']
+    workloads = [x for x in workloads if x['dev_engine'] in supported and x['base_engine'] in supported]
 
     # Skip workloads that are blacklisted on the machine
     if blacklisted := request.POST.getlist('blacklist'):
-        workloads = workloads.exclude(id__in=blacklisted)
+        blacklisted = set(int(x) for x in blacklisted)
+        workloads   = [x for x in workloads if x['id'] not in blacklisted]
 
     # Skip workloads with unmet Syzygy requirements
-    for K in range(machine.info['syzygy_max'] + 1, 10):
-        workloads = workloads.exclude(syzygy_adj='%d-MAN' % (K))
-        workloads = workloads.exclude(syzygy_wdl='%d-MAN' % (K))
+    workloads = [x for x in workloads if x['syzygy_pieces'] <= machine.info['syzygy_max']]
 
     # Skip any workload using, or measuring, Time, for --noisy workers
     if machine.info.get('noisy'):
-        workloads = [x for x in workloads if not OpenBench.utils.workload_uses_time_based_tc(x)]
+        workloads = [x for x in workloads if not x['time_based']]
 
     # Skip workloads that we have insufficient threads to play
     options = [x for x in workloads if valid_hardware_assignment(x, machine)]
@@ -119,23 +225,31 @@ def filter_valid_workloads(request, machine):
         return [], False
 
     # Refine to workloads of the highest priority
-    priorities = [x.priority for x in options]
-    candidates = [x for x in options if x.priority == max(priorities)]
+    priorities = [x['priority'] for x in options]
+    candidates = [x for x in options if x['priority'] == max(priorities)]
 
     # Refine to workloads that match our focus, if applicable
     focuses    = machine.info.get('focus', [])
-    has_focus  = any(x.dev_engine in focuses for x in candidates)
+    has_focus  = any(x['dev_engine'] in focuses for x in candidates)
 
     if has_focus:
-        candidates = list(filter(lambda x: x.dev_engine in focuses, candidates))
+        candidates = list(filter(lambda x: x['dev_engine'] in focuses, candidates))
 
     return candidates, has_focus
 
+def workload_is_cached(request, workload):
+
+    # Clients report the contents of their Engines/ and Networks/ directories
+    binaries = set(request.POST.getlist('binaries'))
+    networks = set(request.POST.getlist('networks'))
+
+    return workload['binaries'] <= binaries and workload['networks'] <= networks
+
 def valid_hardware_assignment(workload, machine):
 
     # Extract thread requirements from the workload itself
-    dev_threads  = int(OpenBench.utils.extract_option(workload.dev_options,  'Threads'))
-    base_threads = int(OpenBench.utils.extract_option(workload.base_options, 'Threads'))
+    dev_threads  = workload['dev_threads']
+    base_threads = workload['base_threads']
 
     # Extract the information from our machine
     threads      = machine.info['concurrency']
@@ -146,39 +260,51 @@ def valid_hardware_assignment(workload, machine):
         threads = threads // 2
 
     # SPSA plays a pair at a time, not a game at a time
-    is_spsa = workload.test_mode == 'SPSA'
+    is_spsa = workload['test_mode'] == 'SPSA'
 
     # Refuse if there are not enough threads for the test
-    if (1 + is_spsa) * max(dev_threads, base_threads) > threads:
+    if (1 + is_spsa) * workload['max_threads'] > threads:
+        return False
+
+    # Refuse if there is not enough memory for the Hash of the test
+    if (1 + is_spsa) > memory_game_limit(workload['hash_mb'], machine):
         return False
 
     # All Criteria have been met
     return True
 
+def memory_game_limit(hash_mb, machine):
+
+    # Concurrent games whose Hash fits within the allowed portion of the Machine's RAM
+    if not hash_mb or 'ram_total_mb' not in machine.info:
+        return sys.maxsize
+
+    usable_mb = machine.info['ram_total_mb'] * OPENBENCH_CONFIG['hash_memory_fraction']
+    return int(usable_mb // hash_mb)
+
 def compute_resource_distribution(workloads, machine, has_focus):
 
     # Return a thread count, and engine name for each workload, as well as the throughput.
-    # The throughput may be scaled down later, due to balance_engine_throughputs
-
-    worker_dist = {
-        workload.id : { 'threads' : 0, 'engine' : workload.dev_engine, 'throughput' : workload.throughput }
-            for workload in workloads
-    }
+    # The throughput may be scaled down later, due to balance_engine_throughputs.
+    # Threads are weighted by each Machine's speed, if using weight_machines_by_nps
 
     # Ignore our own machine;
     # Ignore machines working on non-candidates;
     # Ignore focus-assigned machines when has_focus is false
 
-    for x in OpenBench.utils.getRecentMachines():
-        if x != machine and x.workload in worker_dist:
-            if has_focus or worker_dist[x.workload]['engine'] not in x.info.get('focus', []):
-                worker_dist[x.workload]['threads'] += x.info['concurrency']
+    worker_dist = {
+        workload['id'] : {
+            'threads'    : SNAPSHOT.assigned_threads(workload['id'], has_focus, machine.id),
+            'engine'     : workload['dev_engine'],
+            'throughput' : workload['throughput'],
+        } for workload in workloads
+    }
 
     # Count of tests that exist for a particular dev_engine
 
     engine_freq = {}
     for workload in workloads:
-        engine_freq[workload.dev_engine] = engine_freq.get(workload.dev_engine, 0) + 1
+        engine_freq[workload['dev_engine']] = engine_freq.get(workload['dev_engine'], 0) + 1
 
     return worker_dist, engine_freq
 
@@ -205,104 +331,180 @@ def workload_to_dictionary(test, result, machine):
         'scale_nps'     : test.scale_nps,
     }
 
-    workload['test']['book'] = {
-        'name'   : test.book_name,
-        'sha'    : OPENBENCH_CONFIG['books'].get(test.book_name, { 'sha'    : None })['sha'   ],
-        'source' : OPENBENCH_CONFIG['books'].get(test.book_name, { 'source' : None })['source'],
-    }
-
-    workload['test']['dev'] = {
-        'id'           : test.dev.id,
-        'name'         : test.dev.name,
-        'source'       : test.dev.source,
-        'sha'          : test.dev.sha,
-        'bench'        : test.dev.bench,
-        'engine'       : test.dev_engine,
-        'options'      : test.dev_options,
-        'network'      : test.dev_network,
-        'netname'      : test.dev_netname,
-        'time_control' : test.dev_time_control,
-        'build'        : OPENBENCH_CONFIG['engines'][test.dev_engine]['build'],
-        'private'      : OPENBENCH_CONFIG['engines'][test.dev_engine]['private'],
-    }
-
-    workload['test']['base'] = {
-        'id'           : test.base.id,
-        'name'         : test.base.name,
-        'source'       : test.base.source,
-        'sha'          : test.base.sha,
-        'bench'        : test.base.bench,
-        'engine'       : test.base_engine,
-        'options'      : test.base_options,
-        'network'      : test.base_network,
-        'netname'      : test.base_netname,
-        'time_control' : test.base_time_control,
-        'build'        : OPENBENCH_CONFIG['engines'][test.base_engine]['build'],
-        'private'      : OPENBENCH_CONFIG['engines'][test.base_engine]['private'],
-    }
+    workload['test']['book'] = book_to_dictionary(test)
+    workload['test']['dev' ] = engine_to_dictionary(test, 'dev' )
+    workload['test']['base'] = engine_to_dictionary(test, 'base')
 
     workload['distribution']   = game_distribution(test, machine)
     workload['spsa']           = spsa_workload_assignment_dict(test, workload['distribution']['runner-count'])
     workload['reporting_type'] = test.spsa_run.reporting_type if test.test_mode == 'SPSA' else ''
 
-    with transaction.atomic():
+    runner_cnt    = workload['distribution']['runner-count']
+    pairs_per_cnt = workload['distribution']['rounds-per-runner'] // 2
+    per_opening   = 2 if (test.test_mode == 'DATAGEN' and not test.play_reverses) else 1
 
-        test = Test.objects.select_for_update().get(id=test.id)
-        workload['test']['book_seed' ] = test.id
-        workload['test']['book_index'] = test.book_index
+    workload['test']['book_seed' ] = test.id
+    workload['test']['book_index'] = allocate_book_indices(test, runner_cnt * pairs_per_cnt * per_opening)
 
-        runner_cnt    = workload['distribution']['runner-count']
-        pairs_per_cnt = workload['distribution']['rounds-per-runner'] // 2
-        per_opening   = 2 if (test.test_mode == 'DATAGEN' and not test.play_reverses) else 1
+    if test.test_mode == 'DATAGEN':
+        workload['test']['genfens_seeds'] = [
+            random.randint(0, 2**31 - 1) for x in range(machine.info['concurrency'])]
 
-        test.book_index += runner_cnt * pairs_per_cnt * per_opening
+    return workload
 
-        if test.test_mode == 'DATAGEN':
-            workload['test']['genfens_seeds'] = [
-                random.randint(0, 2**31 - 1) for x in range(machine.info['concurrency'])]
+def allocate_book_indices(test, count):
 
-        test.save()
+    # Reserve the next count openings. The UPDATE holds the lock on the BookCursor
+    # row until the end of the transaction, so the following read sees our own
+    # increment, and no other. The Test row itself is never locked
 
-    return workload
+    with transaction.atomic():
+        BookCursor.objects.filter(test_id=test.id).update(index=F('index') + count)
+        return BookCursor.objects.get(test_id=test.id).index - count
 
-def extract_option(options, option):
+def book_to_dictionary(test):
 
-    if (match := re.search('(?<=%s=")[^"]*' % (option), options)):
-        return match.group()
+    return {
+        'name'   : test.book_name,
+        'sha'    : OPENBENCH_CONFIG['books'].get(test.book_name, { 'sha'    : None })['sha'   ],
+        'source' : OPENBENCH_CONFIG['books'].get(test.book_name, { 'source' : None })['source'],
+    }
+
+def engine_to_dictionary(test, branch):
 
-    if (match := re.search('(?<=%s=\')[^\']*' % (option), options)):
-        return match.group()
+    engine      = getattr(test, branch)
+    engine_name = getattr(test, '%s_engine' % (branch))
 
-    if (match := re.search('(?<=%s=)[^ ]*' % (option), options)):
-        return match.group()
+    return {
+        'id'           : engine.id,
+        'name'         : engine.name,
+        'source'       : engine.source,
+        'sha'          : engine.sha,
+        'bench'        : engine.bench,
+        'engine'       : engine_name,
+        'options'      : getattr(test, '%s_options'      % (branch)),
+        'network'      : getattr(test, '%s_network'      % (branch)),
+        'netname'      : getattr(test, '%s_netname'      % (branch)),
+        'time_control' : getattr(test, '%s_time_control' % (branch)),
+        'build'        : OPENBENCH_CONFIG['engines'][engine_name]['build'],
+        'private'      : OPENBENCH_CONFIG['engines'][engine_name]['private'],
+    }
 
 def game_distribution(test, machine):
 
-    dev_threads  = int(extract_option(test.dev_options, 'Threads'))
-    base_threads = int(extract_option(test.base_options, 'Threads'))
+    dev_threads  = test.dev_threads
+    base_threads = test.base_threads
 
     worker_threads = machine.info['concurrency']
     worker_sockets = machine.info['sockets']
+    bench_threads  = machine.info['concurrency']
 
     # For core-odds tests, disable hyperthreads, by halving the thread count
     if machine.info['physical_cores'] < worker_threads and dev_threads != base_threads:
         worker_threads = worker_threads // 2
 
+    # Otherwise, disable hyperthreads if they were measured to reduce throughput. Benches
+    # are then run on only the physical cores as well, to match the load during games
+    elif prefers_physical_cores(machine, max(dev_threads, base_threads)):
+        worker_threads = bench_threads = machine.info['physical_cores']
+
     # Ignore sockets for concurrent match runners, when playing with more than one thread
     if max(dev_threads, base_threads) > 1:
         worker_sockets = 1
 
+    # Ignore sockets when memory does not allow even a single game on each of them
+    memory_limit = memory_game_limit(test.hash_mb, machine)
+    if memory_limit < worker_sockets:
+        worker_sockets = 1
+
     # Max possible concurrent engine games, per copy of match runner
     max_concurrency = (worker_threads // worker_sockets) // max(dev_threads, base_threads)
+    max_concurrency = max(1, min(max_concurrency, memory_limit // worker_sockets))
 
     # Number of params being evaluated at a single time, if doing SPSA in SINGLE mode
     spsa_count = (worker_threads // max(dev_threads, base_threads)) // 2
+    spsa_count = max(1, min(spsa_count, memory_limit // 2))
 
     # SPSA is treated specially, if we are distributing many parameter sets at once
     is_multiple_spsa = test.test_mode == 'SPSA' and test.spsa_run.distribution_type == 'MULTIPLE'
 
-    return {
+    # Size the workload by duration instead, if configured and able to estimate it
+    rounds_per_runner = 2 * test.workload_size * (1 if is_multiple_spsa else max_concurrency)
+    if test.test_mode != 'SPSA' and (targeted := targeted_rounds(test, machine, max_concurrency)):
+        rounds_per_runner = targeted
+
+    # Shrink the workload as the test nears its end, to avoid overshooting it
+    if test.test_mode != 'SPSA' and (tail := tail_rounds(test, machine, worker_sockets, max_concurrency)):
+        rounds_per_runner = min(rounds_per_runner, tail)
+
+    distribution = {
         'runner-count'      : spsa_count if is_multiple_spsa else worker_sockets,
         'concurrency-per'   : 2 if is_multiple_spsa else max_concurrency,
-        'rounds-per-runner' : 2 * test.workload_size * (1 if is_multiple_spsa else max_concurrency),
+        'rounds-per-runner' : rounds_per_runner,
+        'bench-threads'     : bench_threads,
     }
+
+    # Pin each copy of the match runner to its own NUMA nodes, when the topology allows
+    if not is_multiple_spsa and (cpusets := runner_cpusets(machine, worker_sockets)):
+        distribution['cpusets'] = cpusets
+
+    return distribution
+
+def runner_cpusets(machine, runners):
+
+    # Split the Machine's NUMA nodes evenly amongst the match runner copies, by
+    # giving each a consecutive group of nodes. Nothing is pinned if it does not split
+
+    nodes = machine.info.get('numa_nodes', [])
+    if runners <= 1 or not nodes or len(nodes) % runners:
+        return None
+
+    per_runner = len(nodes) // runners
+    return [sum(nodes[x * per_runner:(x + 1) * per_runner], []) for x in range(runners)]
+
+def prefers_physical_cores(machine, threads):
+
+    # Games in parallel, times the speed of each, is proportional to games per hour
+
+    if not (smt := machine.info.get('smt')):
+        return False
+
+    physical = machine.info['physical_cores']
+    logical  = machine.info['concurrency']
+
+    if physical >= logical:
+        return False
+
+    return (physical // threads) * smt['physical_nps'] > (logical // threads) * smt['logical_nps']
+
+def targeted_rounds(test, machine, concurrency):
+
+    target = OPENBENCH_CONFIG['workload_target_seconds']
+    if not target or not (seconds := OpenBench.utils.estimate_game_seconds(test, machine.info.get('speed'))):
+        return None
+
+    # Games are played concurrency at a time. Keep whole pairs, with at least one pair per game slot
+    pairs = int(target * concurrency / seconds) // 2
+    return 2 * max(concurrency, pairs)
+
+def tail_rounds(test, machine, runners, concurrency):
+
+    # Limit the Machine to its share of the expected remaining games, in proportion to
+    # its share of the threads on the test. Keep whole pairs, with one per game slot
+
+    if (remaining := OpenBench.utils.expected_remaining_games(test)) is None:
+        return None
+
+    # Early on, an SPRT's LLR is mostly noise, and extrapolating it would cut workloads
+    # long before the end. Wait until the LLR is well on its way to the bound it nears
+    if test.test_mode == 'SPRT':
+        bound = test.upperllr if test.currentllr > 0 else test.lowerllr
+        if test.currentllr / bound < SPRT_TAIL_FRACTION:
+            return None
+
+    with SNAPSHOT.lock:
+        weight = SNAPSHOT.machine_weight(machine)
+        total  = SNAPSHOT.assigned_threads(test.id, True, machine.id) + weight
+
+    pairs = int(remaining * weight / total / runners) // 2
+    return 2 * max(concurrency, pairs)
@@ -25,6 +25,7 @@
 # requested. This will return the user to the index, or a login page, with some
 # indication as to success, or a reason for failure.
 
+import OpenBench.scheduler
 import OpenBench.views
 
 from OpenBench.models import *
@@ -62,6 +63,7 @@ def modify_workload(request, id, action=None):
     message = actions[action](request, profile, workload)
     LogEvent.objects.create(author=request.user.username, summary=action, log_file='', test_id=id)
     workload.save()
+    OpenBench.scheduler.SNAPSHOT.update_test(workload)
 
     # Send back to the index, notifying them of the success
     return OpenBench.views.redirect(request, '/index/', status=message)
@@ -29,7 +29,7 @@ import datetime
 
 from collections import defaultdict
 
-from django.db.models import BooleanField, ExpressionWrapper, F, Q
+from django.db.models import Exists, OuterRef, Q
 from django.utils import timezone
 
 import OpenBench.views
@@ -70,12 +70,11 @@ def fetch_results(workload):
     target = target - datetime.timedelta(minutes=1)
 
     # Create `active` field for current machines
+    current = ActiveAssignment.objects.filter(
+        machine_id=OuterRef('machine_id'), test_id=OuterRef('test_id'), last_seen__gte=target)
+
     qs = Result.objects.filter(test=workload).select_related('machine__user').annotate(
-        active=ExpressionWrapper(
-            Q(machine__updated__gte=target) &
-            Q(test_id=F('machine__workload')),
-            output_field=BooleanField()
-        )
+        active=Exists(current)
     )
 
     # Drop Results that have played nothing and are no longer active
@@ -95,6 +94,23 @@ def fetch_results(workload):
 
     return list(qs)
 
+def fetch_progress_history(workload):
+
+    # Snapshots of the workload's totals over time, oldest first. Each point is a list,
+    # ordered as the returned fields, with the timestamp given in seconds since the epoch
+    fields = ['timestamp', 'games', 'llr', 'LL', 'LD', 'DD', 'DW', 'WW']
+    qs     = ProgressPoint.objects.filter(test_id=workload.id).order_by('timestamp')
+    points = [[int(timestamp.timestamp()), *rest] for timestamp, *rest in qs.values_list(*fields)]
+
+    # Current totals, when newer than the latest snapshot
+    if not points or points[-1][1] != workload.games:
+        points.append([
+            int(workload.updated.timestamp()), workload.games, workload.currentllr,
+            workload.LL, workload.LD, workload.DD, workload.DW, workload.WW,
+        ])
+
+    return { 'fields' : fields, 'points' : points }
+
 def fetch_result_summaries(workload):
 
     # Aggregate the pentanomial counters across every Result of the workload,
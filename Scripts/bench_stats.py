@@ -0,0 +1,126 @@
+#!/bin/python3
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#                                                                           #
+#   OpenBench is a chess engine testing framework by Andrew Grant.          #
+#   <https://github.com/AndyGrant/OpenBench>  <andrew@grantnet.us>          #
+#                                                                           #
+#   OpenBench is free software: you can redistribute it and/or modify       #
+#   it under the terms of the GNU General Public License as published by    #
+#   the Free Software Foundation, either version 3 of the License, or       #
+#   (at your option) any later version.                                     #
+#                                                                           #
+#   OpenBench is distributed in the hope that it will be useful,            #
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of          #
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the           #
+#   GNU General Public License for more details.                            #
+#                                                                           #
+#   You should have received a copy of the GNU General Public License       #
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.   #
+#                                                                           #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# Replays a synthetic SPRT, a few game-pairs at a time, and compares the cost of a
+# cold PentanomialSPRT() on every update, against one warm-started from the last.
+#
+# Then solves a corpus of synthetic results, of varied sizes and bounds, with both
+# PentanomialSPRT() and PentanomialSPRTBatch(), and verifies that the two agree.
+#
+# >>> python3 Scripts/bench_stats.py --updates 2000 --pairs 16 --corpus 5000
+
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+# Needed to include from ../OpenBench/*.py
+PARENT = os.path.join(os.path.dirname(__file__), os.path.pardir)
+sys.path.append(os.path.abspath(PARENT))
+
+from OpenBench.stats import PentanomialSPRT, PentanomialSPRTBatch
+
+def synthetic_corpus(count, seed):
+
+    generator = np.random.default_rng(seed)
+    results, bounds = [], []
+
+    for x in range(count):
+
+        # Anywhere from a handful of game-pairs, to a long test, and some empty buckets
+        pairs   = random.choice([10, 100, 1000, 10000, 100000])
+        weights = np.array([random.random() for f in range(5)]) * [0.1, 1.0, 1.0, 1.0, 0.1]
+        ptnml   = generator.multinomial(pairs, weights / weights.sum()).tolist()
+
+        if random.random() < 0.10:
+            ptnml[random.randrange(5)] = 0
+
+        results.append(ptnml)
+        bounds.append(random.choice([(0.00, 3.00), (0.00, 5.00), (-3.00, 0.00), (0.50, 2.50), (-5.00, 0.00)]))
+
+    return results, bounds
+
+if __name__ == '__main__':
+
+    p = argparse.ArgumentParser()
+    p.add_argument('-U', '--updates', help='Result submissions to replay', default=2000, type=int)
+    p.add_argument('-P', '--pairs'  , help='Game-pairs per submission'   , default=16  , type=int)
+    p.add_argument('-S', '--seed'   , help='Seed for the synthetic games', default=0   , type=int)
+    p.add_argument('-C', '--corpus' , help='Results to solve in a batch' , default=5000, type=int)
+    args = p.parse_args()
+
+    random.seed(args.seed)
+
+    # Roughly the Ptnml(0-2) of a small gain, at a short time control
+    weights = (0.004, 0.195, 0.600, 0.197, 0.004)
+    elo0, elo1 = (0.00, 3.00)
+
+    results = [0, 0, 0, 0, 0]
+    cold_time = warm_time = worst = 0.00
+
+    for update in range(args.updates):
+
+        for outcome in random.choices(range(5), weights=weights, k=args.pairs):
+            results[outcome] += 1
+
+        start = time.perf_counter()
+        cold  = PentanomialSPRT(results, elo0, elo1)
+        cold_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        warm  = PentanomialSPRT(results, elo0, elo1, key='bench')
+        warm_time += time.perf_counter() - start
+
+        worst = max(worst, abs(cold - warm))
+
+    print('Final LLR            : %.6f' % (cold))
+    print('Cold us per update   : %.1f' % (1e6 * cold_time / args.updates))
+    print('Warm us per update   : %.1f' % (1e6 * warm_time / args.updates))
+    print('Max |Cold - Warm|    : %.3e' % (worst))
+
+    results, bounds = synthetic_corpus(args.corpus, args.seed)
+    elo0, elo1      = zip(*bounds)
+
+    def scalar_sprt(ptnml, lower, upper):
+        try: return PentanomialSPRT(ptnml, lower, upper)
+        except AssertionError: return np.nan # Too extreme for the scalar solver to converge
+
+    start  = time.perf_counter()
+    scalar = np.array([scalar_sprt(x, lower, upper) for x, (lower, upper) in zip(results, bounds)])
+    scalar_time = time.perf_counter() - start
+
+    start  = time.perf_counter()
+    batch  = PentanomialSPRTBatch(results, elo0, elo1)
+    batch_time = time.perf_counter() - start
+
+    worst = np.nanmax(np.abs(scalar - batch))
+
+    print('Scalar us per result : %.1f' % (1e6 * scalar_time / args.corpus))
+    print('Batch us per result  : %.1f' % (1e6 * batch_time / args.corpus))
+    print('Scalar failures      : %d' % (np.isnan(scalar).sum()))
+    print('Max |Scalar - Batch| : %.3e' % (worst))
+
+    if worst > 1e-9:
+        sys.exit('PentanomialSPRTBatch() disagrees with PentanomialSPRT()')